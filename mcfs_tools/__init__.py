@@ -5,5 +5,6 @@ Author: Hank Wu
 Organization: Seedspider Ltd, New Zealand
 """
 
-from .ymodem import Ymodem
+from .ymodem import Ymodem, TransferStats, BlockSizePolicy, AdaptiveBlockSizePolicy
+from .clock import Clock, SimulatedClock
 from .streams import StreamAbstract, make_stream, get_stream_names
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Time source of the protocol and stream code.
+
+Everything that waits or measures a timeout goes through a Clock, so tests and benchmarks can swap
+the monotonic wall clock for SimulatedClock and run loss and timeout scenarios without waiting.
+"""
+
+import threading
+from time import monotonic, sleep
+
+
+class Clock:
+    """
+    Monotonic wall clock, the default of every stream.
+    """
+
+    # the C functions themselves, the wait loops of the streams call time() on every poll.
+    time = staticmethod(monotonic)
+    sleep = staticmethod(sleep)
+
+    def idle(self, until: float = None) -> None:
+        """
+        Called by polling loops that found nothing to read. until is the time the loop gives up.
+        The wall clock keeps polling.
+        """
+        pass
+
+    def notify(self) -> None:
+        """
+        Called by in-memory streams after sending, so simulated pollers wake up.
+        """
+        pass
+
+
+class SimulatedClock(Clock):
+    """
+    Discrete event clock for loopback tests and benchmarks.
+
+    The tasks given to run() execute one at a time. A task holds the clock until it sleeps or idles,
+    then the next task whose deadline has passed takes over. Only when no task can run does the time
+    jump to the earliest deadline. Polling tasks are also woken whenever another task sent data.
+    A 5 s timeout therefore costs one step instead of 5 s, and the outcome of a run does not depend on
+    thread scheduling, only on the tasks and their inputs.
+
+        clock = SimulatedClock(limit=600)
+        a, b = LoopbackStream.pair(clock=clock)
+        sent, received = clock.run(lambda: Ymodem(a).send("app.bin", data), lambda: Ymodem(b).recv_batch())
+
+    Only threads started by run() may sleep or idle on the clock.
+    """
+
+    def __init__(self, tick: float = 0.001, start: float = 0.0, limit: float = None) -> None:
+        """
+        :param tick: shortest step of a polling loop.
+        :param limit: waits raise TimeoutError once the time passes this, so a task waiting for
+            a peer that gave up does not spin forever.
+        """
+        self.now = start
+        self.tick = tick
+        self.limit = limit
+        self.condition = threading.Condition()
+        self.tasks = {}         # thread id -> task index
+        self.deadlines = {}     # task index -> wake up time, for the waiting tasks
+        self.pollers = set()    # waiting tasks that also wake up on notify()
+        self.running = None     # task index holding the clock
+        self.last = -1
+        self.count = 0
+        self.active = 0
+        self.sent = False
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.wait_until(self.now + seconds, poll=False)
+
+    def idle(self, until: float = None) -> None:
+        deadline = self.now + self.tick
+        if until is not None:
+            deadline = max(until, deadline)
+        self.wait_until(deadline, poll=True)
+
+    def notify(self) -> None:
+        self.sent = True
+
+    def wait_until(self, deadline: float, poll: bool) -> None:
+        me = self.tasks.get(threading.get_ident())
+        if me is None:
+            raise RuntimeError("Only tasks started by SimulatedClock.run() can wait on the clock.")
+        with self.condition:
+            self.deadlines[me] = deadline
+            if poll:
+                self.pollers.add(me)
+            self.switch()
+            while self.running != me:
+                self.condition.wait()
+        if self.limit is not None and self.now > self.limit:
+            raise TimeoutError(f"Simulated time limit of {self.limit} s reached.")
+
+    def switch(self) -> None:
+        """
+        Hand the clock to the next task. Called with the condition held.
+        """
+        self.running = None
+        if self.sent:
+            self.sent = False
+            for task in self.pollers:
+                self.deadlines[task] = self.now
+        if not self.deadlines or len(self.deadlines) < self.active:
+            return  # done, or a task has not started yet.
+
+        due = [task for task, deadline in self.deadlines.items() if deadline <= self.now]
+        if not due:
+            self.now = min(self.deadlines.values())
+            due = [task for task, deadline in self.deadlines.items() if deadline <= self.now]
+        task = min(due, key=lambda t: (t - self.last - 1) % self.count)  # round robin
+
+        del self.deadlines[task]
+        self.pollers.discard(task)
+        self.running = self.last = task
+        self.condition.notify_all()
+
+    def run(self, *tasks) -> list:
+        """
+        Run the callables as simulated tasks until all of them return.
+        :return: their return values. The first exception raised by a task is raised again.
+        """
+        results = [None] * len(tasks)
+        errors = []
+
+        def body(index, task):
+            with self.condition:
+                self.tasks[threading.get_ident()] = index
+                self.deadlines[index] = self.now
+                if self.running is None:
+                    self.switch()
+                while self.running != index:
+                    self.condition.wait()
+            try:
+                results[index] = task()
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                with self.condition:
+                    self.active -= 1
+                    self.switch()
+
+        self.count = self.active = len(tasks)
+        self.tasks = {}
+        self.last = -1
+        threads = [threading.Thread(target=body, args=(i, task), daemon=True) for i, task in enumerate(tasks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+
+DEFAULT_CLOCK = Clock()
@@ -0,0 +1,302 @@
+"""
+Flash a mixed fleet from a manifest that maps channel and motor id to images.
+
+    # fleet.yaml (or the same structure as JSON)
+    history: throughput.json        # optional, relative to the manifest
+    channels:
+      can0:
+        slots: 2                    # concurrent transfers on this bus, default 1
+        motors:
+          1: app_a.bin
+          2: [boot.bin, app_b.bin]  # several images are sent in one batch session
+      can1:
+        motors:
+          1: app_c.bin
+
+Every motor is wired to one bus, so the scheduler assigns each transfer to a concurrency slot of its
+bus. Durations are estimated from the image size and the throughput measured on earlier runs for
+the motor (or, failing that, the bus), and the slots of each bus take the longest pending transfer
+first. A failed transfer is queued again, and a transfer running much slower than estimated
+rescales the estimates of its bus and re-plans the pending ones.
+"""
+
+from .clock import Clock, DEFAULT_CLOCK
+from .streams import make_stream
+from .ymodem import Ymodem, Logger
+
+import heapq
+import json
+import os
+import threading
+
+
+class FleetJob:
+    """
+    Images to send to one motor.
+    """
+
+    def __init__(self, channel: str, motor_id: int, filenames: list) -> None:
+        self.channel = channel
+        self.motor_id = motor_id
+        self.filenames = filenames
+        self.size = sum(os.path.getsize(f) for f in filenames)
+        self.estimate = 0.0     # seconds
+        self.attempts = 0
+        self.ok = None
+        self.duration = None
+
+    def __repr__(self) -> str:
+        return f"FleetJob({self.channel}:{self.motor_id}, {', '.join(os.path.basename(f) for f in self.filenames)}, {self.size} bytes)"
+
+
+def load_manifest(path: str) -> tuple:
+    """
+    Read a YAML or JSON manifest.
+    :return: (jobs, slots per channel, history path or None)
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required for YAML manifests, use JSON or pip install pyyaml.")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(path))
+    jobs, slots = [], {}
+    for channel, config in manifest["channels"].items():
+        slots[channel] = int(config.get("slots", 1))
+        if slots[channel] < 1:
+            raise ValueError(f"Channel {channel} needs at least one slot.")
+        for motor_id, images in config["motors"].items():
+            if isinstance(images, str):
+                images = [images]
+            filenames = [os.path.join(base, image) for image in images]
+            for filename in filenames:
+                if not filename.endswith(".bin"):
+                    raise ValueError(f"Only .bin files are supported: {filename}")
+                if not os.path.exists(filename):
+                    raise FileNotFoundError(f"File not found: {filename}")
+            jobs.append(FleetJob(channel, int(motor_id), filenames))
+
+    history = manifest.get("history")
+    if history is not None:
+        history = os.path.join(base, history)
+    return jobs, slots, history
+
+
+class ThroughputHistory:
+    """
+    Moving average of the throughput of past transfers, in bytes per second of wall time
+    including the OTA trigger and session setup, per motor and per bus. Stored as JSON.
+    """
+
+    DEFAULT_RATE = 8000.0   # rough 1 Mbit/s CAN figure, used until something was measured.
+
+    def __init__(self, path: str = None, alpha: float = 0.5) -> None:
+        self.path = path
+        self.alpha = alpha
+        self.motors = {}    # "channel:motor_id" -> bytes/s
+        self.buses = {}     # channel -> bytes/s
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.motors = data.get("motors", {})
+            self.buses = data.get("buses", {})
+
+    def rate(self, channel: str, motor_id: int) -> float:
+        rate = self.motors.get(f"{channel}:{motor_id}")
+        if rate is None:
+            rate = self.buses.get(channel, ThroughputHistory.DEFAULT_RATE)
+        return rate
+
+    def record(self, channel: str, motor_id: int, size: int, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        rate = size / seconds
+        key = f"{channel}:{motor_id}"
+        for table, k in ((self.motors, key), (self.buses, channel)):
+            old = table.get(k)
+            table[k] = rate if old is None else old + self.alpha * (rate - old)
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with open(self.path, "w") as f:
+            json.dump({"motors": self.motors, "buses": self.buses}, f, indent=4)
+
+
+def plan_slots(jobs: list, free_at: list) -> tuple:
+    """
+    Longest job first onto the slot that becomes free earliest.
+    :param free_at: time at which each slot of the bus is free.
+    :return: ([(job, slot, start, end)], makespan)
+    """
+    heap = [(t, slot) for slot, t in enumerate(free_at)]
+    heapq.heapify(heap)
+    plan = []
+    for job in sorted(jobs, key=lambda j: j.estimate, reverse=True):
+        start, slot = heapq.heappop(heap)
+        end = start + job.estimate
+        plan.append((job, slot, start, end))
+        heapq.heappush(heap, (end, slot))
+    return plan, max(t for t, slot in heap)
+
+
+class FleetScheduler:
+    """
+    Plan and run the jobs of a manifest.
+
+    :param stream_factory: callable(channel, motor_id) -> StreamAbstract,
+        by default make_stream(stream_type, motor_id=motor_id, channel=channel).
+    :param retries: extra attempts for a failed transfer.
+    :param slow_ratio: a transfer whose throughput falls below this fraction of the estimate
+        triggers a re-plan of its bus, once it has run for min_elapsed seconds.
+    """
+
+    def __init__(self, jobs: list, slots: dict, history: ThroughputHistory = None, stream_factory = None,
+                 stream_type: str = "socketcan", retries: int = 1, slow_ratio: float = 0.5, min_elapsed: float = 1.0,
+                 block_policy_factory = None, clock: Clock = DEFAULT_CLOCK) -> None:
+        self.jobs = jobs
+        self.slots = slots
+        self.history = history if history is not None else ThroughputHistory()
+        if stream_factory is None:
+            stream_factory = lambda channel, motor_id: make_stream(stream_type, motor_id=motor_id, channel=channel)
+        self.stream_factory = stream_factory
+        self.retries = retries
+        self.slow_ratio = slow_ratio
+        self.min_elapsed = min_elapsed
+        self.block_policy_factory = block_policy_factory
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.scale = {channel: 1.0 for channel in slots}    # observed / estimated duration per bus
+        self.pending = {}
+        self.running = {}   # channel -> {slot: (job, start time)}
+        self.start_time = 0.0
+        self.estimate_all()
+
+    def estimate_all(self) -> None:
+        for job in self.jobs:
+            job.estimate = job.size / self.history.rate(job.channel, job.motor_id) * self.scale[job.channel]
+
+    def plan(self) -> tuple:
+        """
+        Predicted schedule of the jobs that have not finished, from now on.
+        :return: ({channel: [(job, slot, start, end)]}, makespan) with times in seconds from the start of the run.
+        """
+        now = self.clock.time() - self.start_time if self.running else 0.0
+        plans, makespan = {}, 0.0
+        for channel, n in self.slots.items():
+            free_at = [now] * n
+            for slot, (job, started) in self.running.get(channel, {}).items():
+                free_at[slot] = max(now, started - self.start_time + job.estimate)
+            jobs = self.pending.get(channel) if self.running else [j for j in self.jobs if j.channel == channel]
+            plans[channel], end = plan_slots(jobs or [], free_at)
+            makespan = max(makespan, end)
+        return plans, makespan
+
+    def print_plan(self) -> None:
+        plans, makespan = self.plan()
+        for channel, plan in plans.items():
+            print(f"{channel} ({self.slots[channel]} slot{'s' if self.slots[channel] > 1 else ''}):")
+            for job, slot, start, end in sorted(plan, key=lambda p: (p[1], p[2])):
+                print(f"  slot {slot}  {start:7.1f} - {end:7.1f} s  motor {job.motor_id:3d}  "
+                      f"{job.size:8d} bytes  {', '.join(os.path.basename(f) for f in job.filenames)}")
+        print(f"Predicted makespan: {makespan:.1f} s")
+
+    def run(self) -> dict:
+        """
+        Flash all jobs, each bus in its own threads.
+        :return: (channel, motor_id) -> True if the motor was flashed.
+        """
+        self.start_time = self.clock.time()
+        self.pending = {channel: sorted([j for j in self.jobs if j.channel == channel], key=lambda j: j.estimate, reverse=True)
+                        for channel in self.slots}
+        self.running = {channel: {} for channel in self.slots}
+        threads = [threading.Thread(target=self.worker, args=(channel, slot), daemon=True)
+                   for channel, n in self.slots.items() for slot in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.history.save()
+        Logger.info(f"Fleet run finished in {self.clock.time() - self.start_time:.1f} s.")
+        return {(job.channel, job.motor_id): bool(job.ok) for job in self.jobs}
+
+    def worker(self, channel: str, slot: int) -> None:
+        while True:
+            with self.lock:
+                if not self.pending[channel]:
+                    return
+                job = self.pending[channel].pop(0)
+                job.attempts += 1
+                started = self.clock.time()
+                self.running[channel][slot] = (job, started)
+
+            ok = self.flash(job, started)
+            elapsed = self.clock.time() - started
+
+            with self.lock:
+                del self.running[channel][slot]
+                if ok:
+                    job.ok, job.duration = True, elapsed
+                    self.history.record(channel, job.motor_id, job.size, elapsed)
+                    Logger.info(f"{channel}:{job.motor_id} flashed in {elapsed:.1f} s (estimate {job.estimate:.1f} s).")
+                elif job.attempts <= self.retries:
+                    Logger.warning(f"{channel}:{job.motor_id} failed, queued again.")
+                    self.pending[channel].append(job)
+                    self.replan(channel)
+                else:
+                    job.ok = False
+                    Logger.error(f"{channel}:{job.motor_id} failed after {job.attempts} attempts.")
+
+    def flash(self, job: FleetJob, started: float) -> bool:
+        slow = [False]
+        done = [0]  # bytes of the files of a batch already sent
+
+        def progress(sent, total):
+            job_sent = done[0] + sent
+            if sent == total:
+                done[0] += total
+            elapsed = self.clock.time() - started
+            if slow[0] or elapsed < self.min_elapsed or job_sent < job.size * 0.1:
+                return
+            expected = job.estimate * job_sent / job.size
+            if expected < elapsed * self.slow_ratio:
+                slow[0] = True
+                with self.lock:
+                    self.scale[job.channel] *= elapsed / expected
+                    job.estimate *= elapsed / expected
+                    Logger.warning(f"{job.channel}:{job.motor_id} runs {elapsed / expected:.1f}x slower than estimated.")
+                    self.replan(job.channel)
+
+        try:
+            files = []
+            for filename in job.filenames:
+                with open(filename, "rb") as f:
+                    files.append((os.path.basename(filename), f.read()))
+
+            with self.stream_factory(job.channel, job.motor_id) as stream:
+                stream.initiate_ota()
+                block_policy = self.block_policy_factory() if self.block_policy_factory is not None else None
+                protocol = Ymodem(stream, block_policy)
+                protocol.progress_callback = progress
+                if len(files) == 1:
+                    return protocol.send(files[0][0], files[0][1])
+                return protocol.send_batch(files)
+        except Exception as e:
+            # anything escaping here would end the worker of the slot and strand the rest of the bus.
+            Logger.error(f"Flashing {job.channel}:{job.motor_id} failed: {e}")
+            return False
+
+    def replan(self, channel: str) -> None:
+        """
+        Refresh the estimates and the order of the pending jobs of a bus. Called with the lock held.
+        """
+        for job in self.pending[channel]:
+            job.estimate = job.size / self.history.rate(channel, job.motor_id) * self.scale[channel]
+        self.pending[channel].sort(key=lambda j: j.estimate, reverse=True)
+        plans, makespan = self.plan()
+        Logger.info(f"Re-planned {channel}, predicted makespan now {makespan:.1f} s.")
@@ -0,0 +1,97 @@
+"""
+Logging helpers for the per packet / per frame code paths.
+"""
+
+import logging
+import struct
+import time
+
+
+class HotLog:
+    """
+    Wrap a logger for messages emitted on every packet.
+
+    The enabled levels are cached (call refresh() after changing the logger level), so a disabled
+    message costs one attribute check and the arguments are never formatted.
+    limited() emits a given message at most once per interval and reports how many were suppressed.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = 1.0) -> None:
+        self.logger = logger
+        self.interval = interval
+        self.last_emit = {}
+        self.suppressed = {}
+        self.refresh()
+
+    def refresh(self) -> None:
+        self.debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        self.info_enabled = self.logger.isEnabledFor(logging.INFO)
+
+    def debug(self, msg: str, *args) -> None:
+        if self.debug_enabled:
+            self.logger.debug(msg, *args)
+
+    def limited(self, level: int, msg: str, *args) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.time()
+        if now - self.last_emit.get(msg, 0.0) < self.interval:
+            self.suppressed[msg] = self.suppressed.get(msg, 0) + 1
+            return
+        suppressed = self.suppressed.pop(msg, 0)
+        self.last_emit[msg] = now
+        if suppressed:
+            self.logger.log(level, msg + " (%d similar messages suppressed)", *args, suppressed)
+        else:
+            self.logger.log(level, msg, *args)
+
+
+class PacketEventRing:
+    """
+    Fixed size binary ring buffer of per packet events.
+    Recording packs one record into a preallocated buffer; nothing is formatted until dump() is called,
+    which is meant to be done only when a transfer fails.
+    """
+
+    RECORD = struct.Struct("<dBHH")     # time, event, block number, value
+
+    SENT = 0
+    ACK = 1
+    NAK = 2
+    TIMEOUT = 3
+    CANCEL = 4
+    RECV_OK = 5
+    RECV_INVALID = 6
+    RECV_OUT_OF_ORDER = 7
+    EVENT_NAMES = ["SENT", "ACK", "NAK", "TIMEOUT", "CANCEL", "RECV_OK", "RECV_INVALID", "RECV_OUT_OF_ORDER"]
+
+    def __init__(self, size: int = 1024) -> None:
+        self.size = size
+        self.buffer = bytearray(PacketEventRing.RECORD.size * size)
+        self.count = 0
+
+    def record(self, event: int, block: int = 0, value: int = 0) -> None:
+        offset = (self.count % self.size) * PacketEventRing.RECORD.size
+        PacketEventRing.RECORD.pack_into(self.buffer, offset, time.time(), event, block, value)
+        self.count += 1
+
+    def events(self) -> list:
+        """
+        :return: the recorded events, oldest first, as (time, event, block, value) tuples.
+        """
+        first = max(0, self.count - self.size)
+        record_size = PacketEventRing.RECORD.size
+        return [PacketEventRing.RECORD.unpack_from(self.buffer, (i % self.size) * record_size)
+                for i in range(first, self.count)]
+
+    def clear(self) -> None:
+        self.count = 0
+
+    def dump(self, logger: logging.Logger, level: int = logging.ERROR) -> None:
+        events = self.events()
+        if not events:
+            return
+        logger.log(level, "Last %d packet events:", len(events))
+        start = events[0][0]
+        for t, event, block, value in events:
+            logger.log(level, "  %+9.4fs %-17s block %3d value %d", t - start, PacketEventRing.EVENT_NAMES[event], block, value)
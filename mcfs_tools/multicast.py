@@ -0,0 +1,270 @@
+"""
+Flash the same image to several motors at once over a shared CAN bus.
+
+Every Ymodem packet is transmitted once to a group id that the bootloaders accept in addition to
+their own motor id. Each motor still answers on its own id, so ACK/NAK is tracked per motor and
+only the motors that NAKed or timed out get the packet again.
+"""
+
+from .streams import StreamAbstract
+from .streams.socketcan_stream import SocketCanStream
+from .ymodem import Ymodem, Logger
+from .clock import Clock, DEFAULT_CLOCK
+
+from collections import deque
+from tqdm import tqdm
+
+
+class CanBusDemux:
+    """
+    Read frames from a shared bus and route their payload to a receive buffer per motor id.
+    """
+
+    def __init__(self, can_bus, clock: Clock = DEFAULT_CLOCK) -> None:
+        self.can_bus = can_bus
+        self.clock = clock
+        self.buffers = {}
+
+    def register(self, motor_id: int) -> deque:
+        return self.buffers.setdefault(motor_id, deque())
+
+    def poll(self, timeout: float = 0.001) -> bool:
+        msg = self.can_bus.recv(timeout=timeout)
+        if msg is None:
+            return False
+        buffer = self.buffers.get(msg.arbitration_id >> 6)
+        if buffer is not None:
+            buffer.extend(msg.data[:msg.dlc])
+        return True
+
+    def send(self, node_id: int, data: bytes) -> None:
+        SocketCanStream.send_frames(self.can_bus, node_id, data, clock=self.clock)
+
+
+class MotorCanStream(StreamAbstract):
+    """
+    Unicast stream to one motor on a demultiplexed bus.
+    """
+
+    selectable = False
+
+    def __init__(self, demux: CanBusDemux, motor_id: int, **kwarg) -> None:
+        super().__init__()
+        self.demux = demux
+        self.clock = demux.clock
+        self.motor_id = motor_id
+        self.recv_buffer = demux.register(motor_id)
+
+    def recv_byte(self) -> int:
+        if not self.recv_buffer:
+            self.demux.poll()
+        if self.recv_buffer:
+            return self.recv_buffer.popleft()
+        return -1
+
+    def clear_recv_buffer(self) -> None:
+        while self.demux.poll(0):
+            pass
+        self.recv_buffer.clear()
+
+    def send(self, data: bytes) -> None:
+        self.demux.send(self.motor_id, data)
+
+    def initiate_ota(self) -> None:
+        self.demux.can_bus.send(SocketCanStream.ota_trigger_message(self.motor_id))
+
+
+class MotorState:
+
+    def __init__(self, motor_id: int, stream: MotorCanStream) -> None:
+        self.motor_id = motor_id
+        self.stream = stream
+        self.naks = 0
+        self.timeouts = 0
+        self.repairs = 0
+        self.dropped_at = None      # step index where the motor left the group
+        self.position = 0           # next step to send, for motors that left the group
+        self.protocol = None        # unicast Ymodem session, for motors that left the group
+        self.canceled = False
+        self.success = False
+
+    def __repr__(self) -> str:
+        return (f"MotorState(motor_id={self.motor_id}, success={self.success}, canceled={self.canceled}, naks={self.naks}, "
+                f"timeouts={self.timeouts}, repairs={self.repairs}, dropped_at={self.dropped_at})")
+
+
+class MulticastYmodem:
+    """
+    Ymodem sender for a group of motors.
+
+    Each packet is sent to group_id once. Motors that NAK or time out are repaired, by sending the
+    packet to the group again if at least remulticast_ratio of the group needs it, otherwise by
+    unicast to each of them. A motor still failing after max_repairs attempts drops out of the group
+    and is finished with a unicast Ymodem session once the group transfer is done.
+    """
+
+    def __init__(self, can_bus, motor_ids: list, group_id: int, max_repairs: int = 3,
+                 remulticast_ratio: float = 0.5, timeout: float = 1.0, clock: Clock = DEFAULT_CLOCK) -> None:
+        self.demux = CanBusDemux(can_bus, clock)
+        self.clock = clock
+        self.group_id = group_id
+        self.max_repairs = max_repairs
+        self.remulticast_ratio = remulticast_ratio
+        self.timeout = timeout
+        self.motors = {m: MotorState(m, MotorCanStream(self.demux, m)) for m in motor_ids}
+        self.progress_callback = None   # called with (steps done, total steps) after each step
+
+    def initiate_ota(self) -> None:
+        for motor in self.motors.values():
+            motor.stream.initiate_ota()
+
+    def active(self) -> list:
+        return [m for m in self.motors.values() if m.dropped_at is None and not m.success and not m.canceled]
+
+    def lagging(self) -> list:
+        return [m for m in self.motors.values() if m.dropped_at is not None and not m.success and not m.canceled]
+
+    def collect_responses(self, motors: list, timeout: float) -> dict:
+        """
+        Wait for the first response byte of each motor.
+        :return: motor_id -> response, motors that did not answer are missing.
+        """
+        responses = {}
+        start_time = self.clock.time()
+        while len(responses) < len(motors):
+            if self.clock.time() - start_time > timeout:
+                break
+            self.demux.poll()
+            for motor in motors:
+                if motor.motor_id not in responses and motor.stream.recv_buffer:
+                    responses[motor.motor_id] = motor.stream.recv_buffer.popleft()
+        return responses
+
+    def wait_for_request(self, step: int, timeout: float) -> None:
+        waiting = self.active()
+        start_time = self.clock.time()
+        while waiting and self.clock.time() - start_time <= timeout:
+            self.demux.poll()
+            for motor in list(waiting):
+                while motor.stream.recv_buffer:
+                    if motor.stream.recv_buffer.popleft() == Ymodem.C:
+                        waiting.remove(motor)
+                        break
+        for motor in waiting:
+            if step == 0:
+                Logger.error(f"Motor {motor.motor_id} did not request the transfer.")
+                motor.canceled = True
+            else:
+                Logger.warning(f"Motor {motor.motor_id} did not request the next stage, continuing with unicast.")
+                motor.dropped_at = step
+                motor.position = step
+
+    def serve_group_packet(self, step: int, packet: bytes, multicast: bool = True) -> None:
+        pending = self.active()
+        for attempt in range(self.max_repairs + 1):
+            for motor in pending:
+                motor.stream.clear_recv_buffer()
+
+            if attempt > 0:
+                for motor in pending:
+                    motor.repairs += 1
+
+            if multicast:
+                self.demux.send(self.group_id, packet)
+            else:
+                for motor in pending:
+                    motor.stream.send(packet)
+
+            responses = self.collect_responses(pending, self.timeout)
+            still_pending = []
+            for motor in pending:
+                response = responses.get(motor.motor_id, -1)
+                if response == Ymodem.ACK:
+                    continue
+                if response == Ymodem.CAN:
+                    Logger.error(f"Transfer canceled by motor {motor.motor_id}.")
+                    motor.canceled = True
+                    continue
+                if response == -1:
+                    motor.timeouts += 1
+                else:
+                    motor.naks += 1
+                still_pending.append(motor)
+
+            pending = still_pending
+            if not pending:
+                return
+            multicast = multicast and len(pending) >= self.remulticast_ratio * len(self.active())
+
+        for motor in pending:
+            Logger.warning(f"Motor {motor.motor_id} fell behind at step {step}, continuing with unicast.")
+            motor.dropped_at = step
+            motor.position = step
+
+    def serve_unicast_step(self, motor: MotorState, steps: list) -> None:
+        """
+        Advance a motor that left the group by one step.
+        """
+        if motor.protocol is None:
+            motor.protocol = Ymodem(motor.stream)
+        step = steps[motor.position]
+        if step is None:
+            ok = motor.stream.try_wait_for_byte(Ymodem.C, 5.0)
+        else:
+            retransmissions = motor.protocol.retransmission_count
+            ok = motor.protocol.serve_packet(step)
+            motor.naks += motor.protocol.retransmission_count - retransmissions
+        if not ok:
+            Logger.error(f"Unicast transfer to motor {motor.motor_id} failed at step {motor.position}.")
+            motor.canceled = True
+            return
+        motor.position += 1
+        if motor.position == len(steps):
+            motor.success = True
+
+    def send(self, filename, file_data: bytes, show_bar: bool = False) -> dict:
+        """
+        Send the file to every motor of the group.
+
+        Motors that left the group advance one step by unicast for every group step, so they stay a
+        bounded number of blocks behind and never see a group packet with their expected block number
+        but different content. The final EOT is sent by unicast, so it only ends the transfer of
+        the motors that have received everything.
+
+        :return: motor_id -> True if the motor received the file.
+        """
+
+        protocol = Ymodem(MotorCanStream(self.demux, self.group_id))
+        chunk_size = 1024
+        # None marks a point where the receivers request the next stage with a C.
+        steps = [None, protocol.parse_initial_packet(filename, len(file_data)), None]
+        for i, offset in enumerate(range(0, len(file_data), chunk_size)):
+            steps.append(protocol.parse_data_packet(i + 1, file_data[offset: offset + chunk_size]))
+        steps.append(protocol.parse_final_packet())
+
+        with tqdm(total=len(steps), disable=(not show_bar), unit="packet") as pbar:
+            for i, step in enumerate(steps):
+                if self.active():
+                    if step is None:
+                        self.wait_for_request(i, 1.0 if i == 0 else 5.0)
+                    else:
+                        self.serve_group_packet(i, step, multicast=(i != len(steps) - 1))
+                    if i == len(steps) - 1:
+                        for motor in self.active():
+                            motor.success = True
+
+                for motor in self.lagging():
+                    self.serve_unicast_step(motor, steps)
+
+                pbar.set_postfix(in_group=len(self.active()), refresh=False)
+                pbar.update(1)
+                if self.progress_callback is not None:
+                    self.progress_callback(i + 1, len(steps))
+
+        while self.lagging():
+            for motor in self.lagging():
+                self.serve_unicast_step(motor, steps)
+            if self.progress_callback is not None:
+                self.progress_callback(len(steps), len(steps))
+
+        return {m.motor_id: m.success for m in self.motors.values()}
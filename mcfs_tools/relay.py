@@ -0,0 +1,225 @@
+"""
+Edge relay: terminate Ymodem next to the CAN bus.
+
+The remote host uploads the whole image to the relay in one bulk TCP transfer, together with its
+SHA-256 digest. The relay verifies it, runs Ymodem locally against each motor (or one multicast
+session for a group) and streams progress and the final status back as JSON lines.
+
+Request, host -> relay: one JSON line followed by the image bytes
+
+    {"filename": "app.bin", "size": 123456, "sha256": "...", "motor_ids": [1, 2], "group_id": null}
+
+Events, relay -> host: JSON lines
+
+    {"event": "received", "size": 123456}
+    {"event": "progress", "motor_id": 1, "sent": 65536, "total": 123456}
+    {"event": "progress", "group_id": 31, "sent": 40, "total": 124}      (group session, in packets)
+    {"event": "done", "motor_id": 1, "ok": true, "retransmissions": 0}
+    {"event": "finished", "results": {"1": true, "2": true}}
+    {"event": "error", "message": "..."}
+
+The relay has no authentication: it flashes every image it receives to the motors named in the
+request. It listens on all interfaces unless a bind address is given, so only run it on a trusted
+network or bind it to the interface facing the flashing host.
+"""
+
+from .streams import StreamAbstract, make_stream
+from .streams.tcp_stream import TCPClientStream, TCPServerStream
+from .ymodem import Ymodem, Logger
+
+import can
+import hashlib
+import json
+import time
+
+
+def read_line(stream: StreamAbstract, timeout: float) -> bytes:
+    """
+    Read up to a newline. Returns None if nothing arrives for timeout seconds.
+    """
+    line = bytearray()
+    while True:
+        byte = stream.wait_recv_byte(timeout)
+        if byte == -1:
+            return None
+        if byte == ord("\n"):
+            return bytes(line)
+        line.append(byte)
+
+
+def recv_exact(conn: TCPServerStream, size: int, timeout: float) -> bytes:
+    """
+    Read size bytes, one buffer slice at a time. Returns None if the stream is idle for timeout seconds before that.
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.receiver.read(size - len(data), timeout)
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def check_header(filename: str, size: int) -> None:
+    """
+    Raise ValueError if the file cannot be described by a Ymodem header packet.
+    """
+    if size < 0:
+        raise ValueError("Negative file size.")
+    if len(filename.encode("ascii")) + len(str(size)) + 2 > 128:
+        raise ValueError("Filename too long for the Ymodem header.")
+
+
+def send_event(stream: StreamAbstract, **event) -> None:
+    stream.send(json.dumps(event).encode("ascii") + b"\n")
+
+
+class RelayServer:
+    """
+    Accept uploads on port and flash them to the motors on the local bus.
+
+    :param stream_factory: callable(motor_id) -> StreamAbstract used to reach one motor,
+        by default make_stream(stream_type, motor_id=motor_id, channel=channel).
+    :param bus_factory: callable() -> CAN bus used for group sessions,
+        by default can.Bus(channel, interface="socketcan").
+    """
+
+    def __init__(self, port: int, channel: str = "can0", stream_type: str = "socketcan", stream_factory = None,
+                 idle_timeout: float = 10.0, progress_interval: float = 0.5, host: str = "", bus_factory = None) -> None:
+        """
+        :param host: address to listen on, all interfaces by default.
+        """
+        self.host = host
+        self.port = port
+        self.channel = channel
+        self.idle_timeout = idle_timeout
+        self.progress_interval = progress_interval
+        if stream_factory is None:
+            stream_factory = lambda motor_id: make_stream(stream_type, motor_id=motor_id, channel=channel)
+        self.stream_factory = stream_factory
+        if bus_factory is None:
+            bus_factory = lambda: can.Bus(channel, interface="socketcan")
+        self.bus_factory = bus_factory
+
+    def serve_forever(self) -> None:
+        while True:
+            try:
+                self.serve_once()
+            except Exception as e:
+                Logger.error(f"Relay session failed: {e}")
+
+    def serve_once(self) -> dict:
+        """
+        Handle one upload.
+        :return: motor_id -> True if the motor was flashed, None if the upload was rejected.
+        """
+        with TCPServerStream(self.port, low_latency=True, host=self.host) as conn:
+            line = read_line(conn, self.idle_timeout)
+            if line is None:
+                Logger.error("Relay client sent no request.")
+                return None
+            try:
+                request = json.loads(line)
+                filename, size, digest = request["filename"], int(request["size"]), request["sha256"]
+                motor_ids = [int(m) for m in request["motor_ids"]]
+                check_header(filename, size)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                send_event(conn, event="error", message=f"Invalid request: {e}")
+                return None
+
+            data = recv_exact(conn, size, self.idle_timeout)
+            if data is None:
+                Logger.error("Relay upload incomplete.")
+                return None
+            if hashlib.sha256(data).hexdigest() != digest:
+                send_event(conn, event="error", message="Checksum mismatch.")
+                return None
+            send_event(conn, event="received", size=size)
+            Logger.info(f"Relay received {filename} ({size} bytes) for motors {motor_ids}.")
+
+            if request.get("group_id") is not None:
+                results = self.flash_group(conn, filename, data, motor_ids, int(request["group_id"]))
+            else:
+                results = {m: self.flash(conn, filename, data, m) for m in motor_ids}
+
+            send_event(conn, event="finished", results={str(m): ok for m, ok in results.items()})
+            return results
+
+    def progress_reporter(self, conn: StreamAbstract, **ids):
+        """
+        Progress callback sending at most one progress event per progress_interval, plus the last one.
+        The events also keep the client from timing out while a long transfer runs.
+        """
+        last_report = [0.0]
+
+        def progress(sent, total):
+            now = time.time()
+            if now - last_report[0] >= self.progress_interval or sent == total:
+                last_report[0] = now
+                send_event(conn, event="progress", **ids, sent=sent, total=total)
+
+        return progress
+
+    def flash(self, conn: StreamAbstract, filename: str, data: bytes, motor_id: int) -> bool:
+        progress = self.progress_reporter(conn, motor_id=motor_id)
+        ok = False
+        protocol = None
+        try:
+            with self.stream_factory(motor_id) as stream:
+                stream.initiate_ota()
+                protocol = Ymodem(stream)
+                protocol.progress_callback = progress
+                ok = protocol.send(filename, data)
+        except Exception as e:
+            Logger.error(f"Flashing motor {motor_id} failed: {e}")
+
+        send_event(conn, event="done", motor_id=motor_id, ok=ok,
+                   retransmissions=protocol.retransmission_count if protocol is not None else 0)
+        return ok
+
+    def flash_group(self, conn: StreamAbstract, filename: str, data: bytes, motor_ids: list, group_id: int) -> dict:
+        from .multicast import MulticastYmodem
+
+        try:
+            bus = self.bus_factory()
+            try:
+                session = MulticastYmodem(bus, motor_ids, group_id)
+                session.progress_callback = self.progress_reporter(conn, group_id=group_id)
+                session.initiate_ota()
+                results = session.send(filename, data)
+            finally:
+                bus.shutdown()
+        except Exception as e:
+            Logger.error(f"Flashing group {group_id} failed: {e}")
+            for motor_id in motor_ids:
+                send_event(conn, event="done", motor_id=motor_id, ok=False, retransmissions=0)
+            return {m: False for m in motor_ids}
+        for motor in session.motors.values():
+            send_event(conn, event="done", motor_id=motor.motor_id, ok=motor.success, retransmissions=motor.naks)
+        return results
+
+
+def upload(ip: str, port: int, filename: str, data: bytes, motor_ids: list, group_id: int = None,
+           on_event = None, idle_timeout: float = 120.0) -> dict:
+    """
+    Upload an image to a relay and wait until it has flashed every motor.
+
+    :param on_event: called with every event dict received from the relay.
+    :return: motor_id -> True if the motor was flashed.
+    """
+    request = {"filename": filename, "size": len(data), "sha256": hashlib.sha256(data).hexdigest(),
+               "motor_ids": list(motor_ids), "group_id": group_id}
+
+    with TCPClientStream(ip, port, low_latency=True) as conn:
+        conn.send(json.dumps(request).encode("ascii") + b"\n" + data)
+        while True:
+            line = read_line(conn, idle_timeout)
+            if line is None:
+                raise ConnectionError("Relay stopped responding.")
+            event = json.loads(line)
+            if on_event is not None:
+                on_event(event)
+            if event["event"] == "error":
+                raise ConnectionError(event["message"])
+            if event["event"] == "finished":
+                return {int(m): ok for m, ok in event["results"].items()}
@@ -0,0 +1,315 @@
+from .stream import StreamAbstract
+
+import copy
+import math
+import random
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+DROP = 0
+CORRUPT = 1
+DELAY = 2
+
+
+class BernoulliFaults:
+    """
+    Independent faults, each unit (byte or frame) is hit with probability rate.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+
+    def gaps(self, injector: "FaultInjector", n: int) -> list:
+        return injector.geometric(self.rate, n)
+
+
+class GilbertElliottFaults:
+    """
+    Two state burst error model. The channel alternates between a good and a bad state,
+    with fault rates good_rate and bad_rate. Each unit the channel leaves the good state with
+    probability p_enter_bad, and leaves the bad state with probability p_leave_bad.
+    """
+
+    def __init__(self, good_rate: float, bad_rate: float, p_enter_bad: float, p_leave_bad: float) -> None:
+        self.good_rate = good_rate
+        self.bad_rate = bad_rate
+        self.p_enter_bad = p_enter_bad
+        self.p_leave_bad = p_leave_bad
+        self.bad = False
+        self.position = 0       # start of the current state, in units
+        self.last_fault = 0
+
+    def gaps(self, injector: "FaultInjector", n: int) -> list:
+        gaps = []
+        while len(gaps) < n:
+            if self.bad:
+                duration, rate = injector.geometric(self.p_leave_bad, 1)[0], self.bad_rate
+            else:
+                duration, rate = injector.geometric(self.p_enter_bad, 1)[0], self.good_rate
+            end = self.position + duration
+            p = self.position
+            while True:
+                p += injector.geometric(rate, 1)[0]
+                if p > end:
+                    break
+                gaps.append(p - self.last_fault)
+                self.last_fault = p
+            self.position = end
+            self.bad = not self.bad
+        return gaps
+
+
+class FaultInjector:
+    """
+    Precomputed fault schedule for one direction of a stream.
+
+    Faults are drawn from the model in batches, so the per byte cost of the wrapper is a counter
+    decrement. Each fault hits one unit of granularity bytes (1 for byte errors, 8 for CAN frames)
+    and is a drop, a corruption of the first byte or a delay, chosen according to the weights.
+
+    Units follow the frame boundaries of a CAN stream: on the send side they restart at the start of
+    every send() call, which the stream splits into frames from its first byte, and on the receive
+    side of a stream with a can_bus each fault hits one received frame.
+    """
+
+    BATCH_SIZE = 1024
+
+    def __init__(self, model, drop: float = 1.0, corrupt: float = 0.0, delay: float = 0.0,
+                 delay_time: float = 0.01, granularity: int = 1, seed: int = 0) -> None:
+        total = drop + corrupt + delay
+        if total <= 0:
+            raise ValueError("At least one of drop, corrupt or delay must be positive.")
+        self.model = model
+        self.weights = [drop / total, corrupt / total, delay / total]
+        self.delay_time = delay_time
+        self.granularity = granularity
+        self.random = random.Random(seed)
+        self.np_random = np.random.default_rng(seed) if np is not None else None
+        self.schedule = []
+        self.index = 0
+        self.counts = [0, 0, 0]
+
+    def geometric(self, p: float, n: int) -> list:
+        """
+        Number of units up to and including the next fault, n samples.
+        """
+        if p <= 0:
+            return [sys.maxsize] * n
+        if p >= 1:
+            return [1] * n
+        if self.np_random is not None:
+            return self.np_random.geometric(p, n).tolist()
+        log_q = math.log(1.0 - p)
+        return [int(math.log(1.0 - self.random.random()) / log_q) + 1 for _ in range(n)]
+
+    def refill(self) -> None:
+        gaps = self.model.gaps(self, FaultInjector.BATCH_SIZE)
+        n = len(gaps)
+        if self.np_random is not None:
+            kinds = self.np_random.choice(3, size=n, p=self.weights).tolist()
+            masks = self.np_random.integers(1, 256, size=n).tolist()
+        else:
+            kinds = self.random.choices(range(3), weights=self.weights, k=n)
+            masks = [self.random.randint(1, 255) for _ in range(n)]
+        # skip: number of clean units before the faulty one.
+        self.schedule = list(zip([g - 1 for g in gaps], kinds, masks))
+        self.index = 0
+
+    def next(self) -> tuple:
+        if self.index >= len(self.schedule):
+            self.refill()
+        fault = self.schedule[self.index]
+        self.index += 1
+        return fault
+
+    @property
+    def dropped(self) -> int:
+        return self.counts[DROP]
+
+    @property
+    def corrupted(self) -> int:
+        return self.counts[CORRUPT]
+
+    @property
+    def delayed(self) -> int:
+        return self.counts[DELAY]
+
+
+class FaultyCanBus:
+    """
+    Receive side of a CAN bus with the faults of an injector applied to whole frames.
+    Both the python-can recv() and the batched frames() of RawSocketCanBus are covered,
+    everything else is forwarded to the wrapped bus.
+    """
+
+    def __init__(self, bus, injector: FaultInjector, clock) -> None:
+        self.bus = bus
+        self.injector = injector
+        self.clock = clock
+        self.skip, self.kind, self.mask = injector.next()
+        self.mask_used = 0
+
+    def __getattr__(self, name):
+        if "bus" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__["bus"], name)
+
+    def fault(self) -> int:
+        """
+        Advance the schedule by one received frame.
+        :return: the kind of fault hitting it, -1 if it is clean.
+        """
+        if self.skip > 0:
+            self.skip -= 1
+            return -1
+        kind = self.kind
+        self.mask_used = self.mask
+        self.injector.counts[kind] += 1
+        self.skip, self.kind, self.mask = self.injector.next()
+        if kind == DELAY:
+            self.clock.sleep(self.injector.delay_time)
+        return kind
+
+    def recv(self, timeout: float = None):
+        msg = self.bus.recv(timeout)
+        if msg is None:
+            return None
+        kind = self.fault()
+        if kind == DROP:
+            return None
+        if kind == CORRUPT and msg.dlc:
+            data = bytearray(msg.data)
+            data[0] ^= self.mask_used
+            msg = copy.copy(msg)
+            msg.data = data
+        return msg
+
+    def frames(self, count: int):
+        for can_id, dlc, data in self.bus.frames(count):
+            kind = self.fault()
+            if kind == DROP:
+                dlc = 0
+            elif kind == CORRUPT and dlc:
+                data = bytes([data[0] ^ self.mask_used]) + data[1:]
+            yield can_id, dlc, data
+
+
+class FaultInjectionStream(StreamAbstract):
+    """
+    Wrap any stream and inject faults in either direction.
+
+    rx and tx are FaultInjector instances, None leaves that direction untouched.
+    With an rx granularity above 1 on a CAN stream, the receive faults are injected per frame by
+    wrapping the can_bus of the wrapped stream in a FaultyCanBus.
+    Attributes not defined here (motor_id, wait_for_ota, ...) are forwarded to the wrapped stream.
+
+    Example, burst losses of whole CAN frames on the receive side:
+
+        rx = FaultInjector(GilbertElliottFaults(1e-4, 0.3, 1e-3, 0.2), granularity=8, seed=1)
+        with FaultInjectionStream(SocketCanStream(0, "vcan0"), rx=rx) as stream:
+            ...
+    """
+
+    selectable = False
+
+    def __init__(self, stream: StreamAbstract, rx: FaultInjector = None, tx: FaultInjector = None, **kwarg) -> None:
+        super().__init__()
+        self.stream = stream
+        self.clock = stream.clock
+        self.rx = rx
+        self.tx = tx
+        self.rx_skip = sys.maxsize
+        self.rx_unit_left = 0
+        if rx is not None and rx.granularity > 1 and hasattr(stream, "can_bus"):
+            stream.can_bus = FaultyCanBus(stream.can_bus, rx, self.clock)
+        elif rx is not None:
+            self.rx_skip, self.rx_kind, self.rx_mask = rx.next()
+            self.rx_skip *= rx.granularity
+        self.tx_skip = sys.maxsize
+        if tx is not None:
+            self.tx_skip, self.tx_kind, self.tx_mask = tx.next()
+
+    def __getattr__(self, name):
+        if "stream" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__["stream"], name)
+
+    def recv_byte(self) -> int:
+        byte = self.stream.recv_byte()
+        if byte == -1:
+            return -1
+        if self.rx_skip > 0:
+            self.rx_skip -= 1
+            return byte
+        return self.rx_fault(byte)
+
+    def rx_fault(self, byte: int) -> int:
+        rx = self.rx
+        first = self.rx_unit_left == 0
+        if first:
+            self.rx_unit_left = rx.granularity
+            rx.counts[self.rx_kind] += 1
+        self.rx_unit_left -= 1
+
+        kind = self.rx_kind
+        if kind == DROP:
+            byte = -1
+        elif kind == CORRUPT and first:
+            byte ^= self.rx_mask
+        elif kind == DELAY and first:
+            self.clock.sleep(rx.delay_time)
+
+        if self.rx_unit_left == 0:
+            self.rx_skip, self.rx_kind, self.rx_mask = rx.next()
+            self.rx_skip *= rx.granularity
+        return byte
+
+    def clear_recv_buffer(self) -> None:
+        # discarded bytes do not go through the fault schedule.
+        self.stream.clear_recv_buffer()
+
+    def send(self, data: bytes) -> None:
+        # units are counted from the start of data, a partial last unit counts as one.
+        if self.tx is None or self.tx_skip * self.tx.granularity >= len(data):
+            self.tx_skip -= len(data) if self.tx is None else -(-len(data) // self.tx.granularity)
+            self.stream.send(data)
+            return
+
+        tx = self.tx
+        out = bytearray()
+        pos = 0
+        while self.tx_skip * tx.granularity < len(data) - pos:
+            start = pos + self.tx_skip * tx.granularity
+            end = min(start + tx.granularity, len(data))
+            out += data[pos:start]
+            tx.counts[self.tx_kind] += 1
+            if self.tx_kind == CORRUPT:
+                out.append(data[start] ^ self.tx_mask)
+                out += data[start + 1:end]
+            elif self.tx_kind == DELAY:
+                if out:
+                    self.stream.send(bytes(out))
+                    out.clear()
+                self.clock.sleep(tx.delay_time)
+                out += data[start:end]
+            pos = end
+            self.tx_skip, self.tx_kind, self.tx_mask = tx.next()
+        self.tx_skip -= -(-(len(data) - pos) // tx.granularity)
+        out += data[pos:]
+        if out:
+            self.stream.send(bytes(out))
+
+    def initiate_ota(self) -> None:
+        self.stream.initiate_ota()
+
+    def __enter__(self):
+        self.stream.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.stream.__exit__(exc_type, exc_value, traceback)
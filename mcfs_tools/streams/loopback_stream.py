@@ -0,0 +1,41 @@
+from .stream import StreamAbstract
+from ..clock import Clock
+
+from collections import deque
+
+
+class LoopbackStream(StreamAbstract):
+    """
+    In-memory stream. Bytes sent are appended to the peer's receive buffer.
+    Without a peer the stream echoes to itself. Use LoopbackStream.pair() to get two connected ends.
+    Pass a SimulatedClock to run the transfer in simulated time.
+    """
+
+    selectable = False
+
+    def __init__(self, peer: "LoopbackStream" = None, clock: Clock = None, **kwarg) -> None:
+        super().__init__()
+        self.recv_buffer = deque()
+        self.peer = peer if peer is not None else self
+        if clock is not None:
+            self.clock = clock
+
+    @staticmethod
+    def pair(clock: Clock = None):
+        a = LoopbackStream(clock=clock)
+        b = LoopbackStream(peer=a, clock=clock)
+        a.peer = b
+        return a, b
+
+    def recv_byte(self) -> int:
+        try:
+            return self.recv_buffer.popleft()
+        except IndexError:
+            return -1
+
+    def clear_recv_buffer(self) -> None:
+        self.recv_buffer.clear()
+
+    def send(self, data: bytes) -> None:
+        self.peer.recv_buffer.extend(data)
+        self.clock.notify()
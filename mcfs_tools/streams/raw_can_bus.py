@@ -0,0 +1,121 @@
+import can
+import select
+import socket
+import struct
+import time
+
+
+# constants from linux/can.h and asm-generic/socket.h, not all of them are exported by the socket module.
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_SFF_MASK = 0x000007FF
+CAN_EFF_MASK = 0x1FFFFFFF
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+TIMESPEC = struct.Struct("@ll")
+
+
+class RawSocketCanBus:
+    """
+    Minimal python-can compatible bus on a raw AF_CAN socket.
+
+    Besides send()/recv() it has recv_batch(), which reads every pending can_frame into a preallocated
+    buffer without building can.Message objects, and records the kernel receive timestamp of each frame.
+    Frames are sent on the same socket, so our own frames are not looped back to the receive side.
+    """
+
+    FRAME = struct.Struct("=IB3x8s")    # struct can_frame
+
+    def __init__(self, channel: str, batch_size: int = 64, sock: socket.socket = None) -> None:
+        self.batch_size = batch_size
+        if sock is None:
+            sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+            sock.bind((channel,))
+        self.socket = sock
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        except OSError:
+            pass
+        self.socket.setblocking(False)
+
+        frame_size = RawSocketCanBus.FRAME.size
+        self.buffer = bytearray(frame_size * batch_size)
+        self.views = [memoryview(self.buffer)[i * frame_size: (i + 1) * frame_size] for i in range(batch_size)]
+        self.timestamps = [0.0] * batch_size
+        self.ancillary_size = socket.CMSG_SPACE(TIMESPEC.size)
+
+    def set_node_filter(self, node_ids) -> None:
+        """
+        Let the kernel drop every standard frame whose node id (arbitration_id >> 6) is not in node_ids.
+        """
+        filters = b"".join(struct.pack("=II", node_id << 6, CAN_EFF_FLAG | CAN_RTR_FLAG | 0x7C0) for node_id in node_ids)
+        self.socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER, filters)
+
+    def send(self, msg: can.Message) -> None:
+        can_id = msg.arbitration_id
+        if msg.is_extended_id:
+            can_id |= CAN_EFF_FLAG
+        if msg.is_remote_frame:
+            can_id |= CAN_RTR_FLAG
+        try:
+            self.socket.send(RawSocketCanBus.FRAME.pack(can_id, msg.dlc, bytes(msg.data)))
+        except (BlockingIOError, OSError) as e:
+            # tx queue full, same as python-can so the callers retry.
+            raise can.CanOperationError(str(e))
+
+    def wait(self, timeout: float) -> bool:
+        return bool(select.select([self.socket], [], [], timeout)[0])
+
+    def read_frame(self, index: int) -> bool:
+        """
+        Read one pending frame into slot index of the buffer.
+        :return: False if no frame is pending.
+        """
+        while True:
+            try:
+                nbytes, ancdata, _, _ = self.socket.recvmsg_into([self.views[index]], self.ancillary_size)
+            except BlockingIOError:
+                return False
+            if nbytes == RawSocketCanBus.FRAME.size:
+                break
+        timestamp = None
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPNS:
+                sec, nsec = TIMESPEC.unpack_from(data)
+                timestamp = sec + nsec * 1e-9
+        self.timestamps[index] = timestamp if timestamp is not None else time.time()
+        return True
+
+    def recv_batch(self, timeout: float = 0.0) -> int:
+        """
+        Read all pending frames, up to batch_size. Waits up to timeout for the first one.
+        :return: number of frames in self.buffer, their timestamps are in self.timestamps.
+        """
+        if not self.read_frame(0):
+            if timeout <= 0 or not self.wait(timeout) or not self.read_frame(0):
+                return 0
+        count = 1
+        while count < self.batch_size and self.read_frame(count):
+            count += 1
+        return count
+
+    def frames(self, count: int):
+        """
+        Iterate over (can_id, dlc, data) of the first count frames read by recv_batch.
+        """
+        return RawSocketCanBus.FRAME.iter_unpack(memoryview(self.buffer)[:count * RawSocketCanBus.FRAME.size])
+
+    def recv(self, timeout: float = None) -> can.Message:
+        if not self.read_frame(0):
+            if not self.wait(timeout) or not self.read_frame(0):
+                return None
+        can_id, dlc, data = next(self.frames(1))
+        is_extended = bool(can_id & CAN_EFF_FLAG)
+        return can.Message(timestamp=self.timestamps[0],
+                           arbitration_id=can_id & (CAN_EFF_MASK if is_extended else CAN_SFF_MASK),
+                           is_extended_id=is_extended, is_remote_frame=bool(can_id & CAN_RTR_FLAG),
+                           is_error_frame=bool(can_id & CAN_ERR_FLAG), dlc=dlc, data=data[:dlc])
+
+    def shutdown(self) -> None:
+        self.socket.close()
@@ -0,0 +1,45 @@
+from .stream import StreamAbstract
+
+import serial
+
+
+class SerialStream(StreamAbstract):
+    """
+    RS-485 / UART stream.
+
+    Reads are non-blocking and pull everything the driver has buffered (up to read_size bytes)
+    in one call; recv_byte then serves bytes from that chunk. Each send is a single write,
+    so a Ymodem packet goes out as one burst.
+    """
+
+    def __init__(self, channel: str = "/dev/ttyUSB0", baudrate: int = 921600, read_size: int = 4096, **kwarg) -> None:
+        super().__init__()
+        self.read_size = read_size
+        self.recv_buffer = b""
+        self.recv_pos = 0
+        self.serial = serial.Serial(channel, baudrate=baudrate, timeout=0, write_timeout=1.0)
+
+    def recv_byte(self) -> int:
+        if self.recv_pos < len(self.recv_buffer):
+            byte = self.recv_buffer[self.recv_pos]
+            self.recv_pos += 1
+            return byte
+
+        data = self.serial.read(max(self.serial.in_waiting, self.read_size))
+        if not data:
+            return -1
+        self.recv_buffer = data
+        self.recv_pos = 1
+        return data[0]
+
+    def clear_recv_buffer(self) -> None:
+        self.recv_buffer = b""
+        self.recv_pos = 0
+        self.serial.reset_input_buffer()
+
+    def send(self, data: bytes) -> None:
+        self.serial.write(data)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.serial.close()
+        return super().__exit__(exc_type, exc_value, traceback)
@@ -1,70 +1,130 @@
 from .stream import StreamAbstract
+from .raw_can_bus import RawSocketCanBus, CAN_EFF_FLAG, CAN_RTR_FLAG, CAN_ERR_FLAG
 import can
-from queue import Queue
-import time
+from collections import deque
 from logzero import logger
+import logging
+from ..hot_log import HotLog
+from ..clock import Clock, DEFAULT_CLOCK
 
 
 class SocketCanStream(StreamAbstract):
 
     OTA_TRIGGER = 0x14
 
-    def __init__(self, motor_id, channel = "can0", custom_bus = None, **kwarg) -> None:
+    def __init__(self, motor_id, channel = "can0", custom_bus = None, raw_socket = False, **kwarg) -> None:
+        """
+        :param raw_socket: use RawSocketCanBus (batched receive, kernel timestamps) instead of python-can.
+            Falls back to python-can if a raw AF_CAN socket cannot be opened.
+        """
         super().__init__()
         self.motor_id = motor_id
-        self.recv_queue = Queue()
+        self.listen_ids = {motor_id}
+        self.recv_queue = deque()
+        self.last_rx_timestamp = None
         self.using_custom_bus = custom_bus is not None
-        if custom_bus is not None:
-            self.can_bus = custom_bus
-        else:
+        self.can_bus = custom_bus
+        if custom_bus is None and raw_socket:
+            try:
+                self.can_bus = RawSocketCanBus(channel)
+                self.can_bus.set_node_filter(self.listen_ids)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"Raw CAN socket not available ({e}), using python-can.")
+                self.can_bus = None
+        if self.can_bus is None:
             self.can_bus = can.Bus(channel, interface="socketcan")
+        self.batched_rx = hasattr(self.can_bus, "recv_batch")
+        self.log = HotLog(logger)
+
+    def add_listen_id(self, node_id: int) -> None:
+        """
+        Also accept frames addressed to node_id, e.g. a group id.
+        """
+        self.listen_ids.add(node_id)
+        if self.batched_rx:
+            self.can_bus.set_node_filter(self.listen_ids)
 
     def recv_byte(self) -> int:
 
-        if not self.recv_queue.empty():
-            return self.recv_queue.get()
+        if self.recv_queue:
+            return self.recv_queue.popleft()
 
-        msg = self.can_bus.recv(timeout=0.001)
+        if self.batched_rx:
+            self.recv_frames(0.001)
+        else:
+            msg = self.can_bus.recv(timeout=0.001)
 
-        if msg is None:
-            return -1
-        
-        # check if message is for us.
-        if (msg.arbitration_id >> 6 == self.motor_id):
-            for i in range(msg.dlc):
-                self.recv_queue.put(msg.data[i]) 
+            if msg is None:
+                return -1
+            
+            # check if message is for us.
+            if (msg.arbitration_id >> 6 in self.listen_ids):
+                self.recv_queue.extend(msg.data[:msg.dlc])
 
-        if not self.recv_queue.empty():
-            return self.recv_queue.get()
+        if self.recv_queue:
+            return self.recv_queue.popleft()
         
         return -1
+
+    def recv_frames(self, timeout) -> None:
+        """
+        Batched receive path of RawSocketCanBus: copy the payload of every pending frame for us
+        into the receive buffer.
+        """
+        bus = self.can_bus
+        count = bus.recv_batch(timeout)
+        ignored_flags = CAN_EFF_FLAG | CAN_RTR_FLAG | CAN_ERR_FLAG
+        for i, (can_id, dlc, data) in enumerate(bus.frames(count)):
+            if not can_id & ignored_flags and can_id >> 6 in self.listen_ids:
+                self.recv_queue.extend(data[:dlc])
+                self.last_rx_timestamp = bus.timestamps[i]
+
+    def clear_recv_buffer(self) -> None:
+        self.recv_queue.clear()
+        if self.batched_rx:
+            while self.can_bus.recv_batch(0):
+                pass
+        else:
+            while self.can_bus.recv(timeout=0) is not None:
+                pass
     
     
     def send(self, data: bytes, timeout = 1.0) -> None:
+        SocketCanStream.send_frames(self.can_bus, self.motor_id, data, timeout, self.clock)
+
+    @staticmethod
+    def send_frames(can_bus, node_id: int, data: bytes, timeout = 1.0, clock: Clock = DEFAULT_CLOCK) -> None:
+        """
+        Split data into 8 byte frames addressed to node_id (a motor or group id) and send them on can_bus.
+        """
         chunk_size = 8
         num_chunks = (len(data) + chunk_size - 1) // chunk_size
         for i in range(num_chunks):
             chunk = data[i * chunk_size : (i + 1) * chunk_size]
-            msg = can.Message(arbitration_id=self.motor_id << 6 | 0x1F << 1 | 1, data=chunk, dlc=len(chunk), is_extended_id=False, is_remote_frame=False)
+            msg = can.Message(arbitration_id=node_id << 6 | 0x1F << 1 | 1, data=chunk, dlc=len(chunk), is_extended_id=False, is_remote_frame=False)
 
-            start_time = time.time()
+            start_time = clock.time()
             while True:
 
-                if timeout > 0 and time.time() - start_time > timeout:
+                if timeout > 0 and clock.time() - start_time > timeout:
                     raise TimeoutError("Timeout sending message")
                 
                 try:
-                    self.can_bus.send(msg)
+                    can_bus.send(msg)
                     break
                 except can.CanOperationError as e:
                     # print("Error sending message: retrying", e)
-                    time.sleep(0.05)
+                    clock.sleep(0.05)
                     continue
             
 
 
+    @staticmethod
+    def ota_trigger_message(motor_id: int) -> can.Message:
+        return can.Message(arbitration_id=motor_id << 6 | SocketCanStream.OTA_TRIGGER << 1 | 1, data=bytes([0]), dlc=1, is_extended_id=False, is_remote_frame=False)
+
     def initiate_ota(self):
-        msg = can.Message(arbitration_id=self.motor_id << 6 | SocketCanStream.OTA_TRIGGER << 1 | 1, data=bytes([0]), dlc=1, is_extended_id=False, is_remote_frame=False)
+        msg = SocketCanStream.ota_trigger_message(self.motor_id)
         logger.debug(f"Sending OTA trigger.")
         self.can_bus.send(msg)
 
@@ -75,11 +135,11 @@ class SocketCanStream(StreamAbstract):
             if msg is None:
                 continue
 
-            if msg.arbitration_id >> 6 == self.motor_id and (msg.arbitration_id >> 1 & 0xff) == 0x14:
+            if msg.arbitration_id >> 6 == self.motor_id and (msg.arbitration_id >> 1 & 0x1F) == SocketCanStream.OTA_TRIGGER:
                 print("Received OTA trigger")
                 return
             else:
-                print("Received message: ", msg)
+                self.log.limited(logging.DEBUG, "Ignoring message while waiting for OTA trigger: %s", msg)
 
     def __exit__(self, exc_type, exc_value, traceback):
         if not self.using_custom_bus:
@@ -1,8 +1,12 @@
+from ..clock import Clock, DEFAULT_CLOCK
+
 from abc import ABC, abstractmethod
-import time
 
 class StreamAbstract(ABC):
 
+    clock: Clock = DEFAULT_CLOCK  # time source of every wait on the stream
+    selectable: bool = True       # listed by make_stream and get_stream_names, False for wrappers and test streams
+
     @abstractmethod
     def send(self, bytes) -> None:
         """
@@ -22,6 +26,14 @@ class StreamAbstract(ABC):
         pass
 
 
+    def clear_recv_buffer(self) -> None:
+        """
+        Discard everything received so far.
+        """
+        while self.recv_byte() != -1:
+            pass
+
+
     def initiate_ota(self) -> None:
         """
         Initiate the OTA process.
@@ -30,25 +42,30 @@ class StreamAbstract(ABC):
 
 
     def wait_recv_byte(self, timeout = 0.1) -> int:
-        start_time = time.time()
+        byte = self.recv_byte()
+        if byte != -1:
+            return byte
+        recv_byte, now, idle = self.recv_byte, self.clock.time, self.clock.idle
+        deadline = now() + timeout
         while True:
-            byte = self.recv_byte()
+            byte = recv_byte()
             if byte != -1:
                 return byte
-            if time.time() - start_time > timeout:
+            if now() > deadline:
                 break
+            idle(deadline)
         return -1
 
 
     def try_wait_for_byte(self, byte:int, timeout) -> bool:
-        start_time = time.time()
+        start_time = self.clock.time()
         while True:
             recv_byte = self.recv_byte()
             if recv_byte == byte:
                 return True
-            if time.time() - start_time > timeout:
+            if self.clock.time() - start_time > timeout:
                 break
-            time.sleep(0.001)
+            self.clock.sleep(0.001)
         return False
 
     def __enter__(self):
@@ -62,11 +79,14 @@ def all_streams(cls):
     return set(cls.__subclasses__()).union(
         [s for c in cls.__subclasses__() for s in all_streams(c)])
 
+def selectable_streams():
+    return [s for s in all_streams(StreamAbstract) if s.selectable]
+
 def make_stream(name: str, **kwarg) -> StreamAbstract:
 
     name = name.lower().replace("stream", "")
     stream_dict = {}
-    streams = all_streams(StreamAbstract)
+    streams = selectable_streams()
     for s in streams:
         stream_dict[s.__name__.lower().replace("stream", "")] = s
 
@@ -76,4 +96,4 @@ def make_stream(name: str, **kwarg) -> StreamAbstract:
     return stream_dict[name](**kwarg)
 
 def get_stream_names():
-    return [s.__name__.lower().replace("stream", "") for s in all_streams(StreamAbstract)]
+    return [s.__name__.lower().replace("stream", "") for s in selectable_streams()]
@@ -1,17 +1,81 @@
 from .stream import StreamAbstract
 
+import selectors
 import socket
 import threading
 from queue import Queue
 import random
 
+class SocketReceiver:
+    """
+    Receive path of the low latency mode, without a thread.
+    Data is read with recv_into into a preallocated buffer when the selector reports the socket readable,
+    so waiting for a response blocks in the kernel instead of polling.
+    """
+
+    def __init__(self, sock: socket.socket, buffer_size: int = 65536) -> None:
+        self.socket = sock
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.buffer = bytearray(buffer_size)
+        self.start = 0
+        self.end = 0
+
+    def fill(self, timeout: float) -> int:
+        if not self.selector.select(timeout):
+            return 0
+        try:
+            n = self.socket.recv_into(self.buffer)
+        except (BlockingIOError, socket.timeout):
+            return 0
+        except OSError:
+            return -1
+        if n == 0:
+            return -1   # connection closed
+        self.start, self.end = 0, n
+        return n
+
+    def recv_byte(self, timeout: float = 0) -> int:
+        if self.start == self.end and self.fill(timeout) <= 0:
+            return -1
+        byte = self.buffer[self.start]
+        self.start += 1
+        return byte
+
+    def read(self, size: int, timeout: float = 0) -> bytes:
+        """
+        Up to size buffered bytes in one slice, refilling the buffer first if it is empty.
+        Returns b"" on timeout or when the connection is closed.
+        """
+        if self.start == self.end and self.fill(timeout) <= 0:
+            return b""
+        end = min(self.end, self.start + size)
+        data = bytes(self.buffer[self.start:end])
+        self.start = end
+        return data
+
+    def clear(self) -> None:
+        self.start = self.end = 0
+        while self.fill(0) > 0:
+            self.start = self.end = 0
+
+    def close(self) -> None:
+        self.selector.close()
+
+
 class TCPClientStream(StreamAbstract):
     
-        def __init__(self, ip: str, port: int, **kwarg) -> None:
+        def __init__(self, ip: str, port: int, low_latency: bool = False, **kwarg) -> None:
+            """
+            :param low_latency: disable Nagle and receive on the calling thread through a selector
+                instead of a polling receive thread.
+            """
             super().__init__()
             self.ip = ip
             self.port = port
+            self.low_latency = low_latency
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.receiver = None
             self.recv_queue = Queue()
             self.thread = threading.Thread(target=self.recv_task)
             self.shutdown_event = threading.Event()
@@ -42,31 +106,61 @@ class TCPClientStream(StreamAbstract):
         def connect(self) -> None:
             self.socket.connect((self.ip, self.port))
             self.socket.settimeout(1)
-            self.thread.start()
+            if self.low_latency:
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.receiver = SocketReceiver(self.socket)
+            else:
+                self.thread.start()
 
 
         def disconnect(self) -> None:
             self.shutdown_event.set()
+            shutdown_socket(self.socket)
+            if self.receiver is not None:
+                self.receiver.close()
             self.socket.close()
-            self.thread.join()
+            if self.thread.is_alive():
+                self.thread.join()
 
         def recv_byte(self) -> int:
+            if self.receiver is not None:
+                return self.receiver.recv_byte()
             if (self.recv_queue.empty()):
                 return -1
             return self.recv_queue.get()
 
+        def wait_recv_byte(self, timeout = 0.1) -> int:
+            if self.receiver is not None:
+                return self.receiver.recv_byte(timeout)
+            return super().wait_recv_byte(timeout)
+
+        def clear_recv_buffer(self) -> None:
+            if self.receiver is not None:
+                self.receiver.clear()
+            else:
+                super().clear_recv_buffer()
+
         def send(self, data: bytes) -> None:
-            self.socket.send(data)
+            self.socket.sendall(data)
 
 
 class TCPServerStream(StreamAbstract):
 
-    def __init__(self, port: int, **kwarg) -> None:
+    def __init__(self, port: int, low_latency: bool = False, host: str = "", **kwarg) -> None:
+        """
+        :param low_latency: disable Nagle and receive on the calling thread through a selector
+            instead of a polling receive thread.
+        :param host: address to listen on, all interfaces by default.
+        """
         super().__init__()
+        self.host = host
         self.port = port
+        self.low_latency = low_latency
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind(('', port))
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
         self.socket.listen(5)
+        self.receiver = None
         self.recv_queue = Queue()
         self.thread = threading.Thread(target=self.recv_task)
         self.shutdown_event = threading.Event()
@@ -93,25 +187,56 @@ class TCPServerStream(StreamAbstract):
         return False
     
     def connect(self):
-        print(f"Waiting connection on 0.0.0.0:{self.port}.")
+        print(f"Waiting connection on {self.host or '0.0.0.0'}:{self.port}.")
         self.client_socket, self.addr = self.socket.accept()
         print("Got connection from", self.addr)
         self.client_socket.settimeout(1)
-        self.thread.start()
+        if self.low_latency:
+            self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.receiver = SocketReceiver(self.client_socket)
+        else:
+            self.thread.start()
 
     def disconnect(self) -> None:
         self.shutdown_event.set()
+        shutdown_socket(self.client_socket)
+        if self.receiver is not None:
+            self.receiver.close()
         self.client_socket.close()
         self.socket.close()
-        self.thread.join()
+        if self.thread.is_alive():
+            self.thread.join()
 
     def recv_byte(self) -> int:
+        if self.receiver is not None:
+            return self.receiver.recv_byte()
         if (self.recv_queue.empty()):
             return -1
         return self.recv_queue.get()
 
+    def wait_recv_byte(self, timeout = 0.1) -> int:
+        if self.receiver is not None:
+            return self.receiver.recv_byte(timeout)
+        return super().wait_recv_byte(timeout)
+
+    def clear_recv_buffer(self) -> None:
+        if self.receiver is not None:
+            self.receiver.clear()
+        else:
+            super().clear_recv_buffer()
+
     def send(self, data: bytes) -> None:
-        self.client_socket.send(data)
+        self.client_socket.sendall(data)
+
+
+def shutdown_socket(sock: socket.socket) -> None:
+    """
+    Shut the connection down so a blocked recv returns at once instead of waiting for its timeout.
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
 
 
 
@@ -119,21 +244,21 @@ class UnreliableTCPClientStream(TCPClientStream):
 
     def __init__(self, ip: str, port: int) -> None:
         super().__init__(ip, port)
-        random.seed(10)
+        self.random = random.Random(10)
 
     def recv_byte(self) -> int:
         b = super().recv_byte()
         if b == -1:
             return -1
         
-        if random.uniform(0,1) < 0.002:
+        if self.random.uniform(0,1) < 0.002:
             
             # simulate lost packet
-            if random.randint(0, 1) == 0:
+            if self.random.randint(0, 1) == 0:
                 # print("Simulating lost packet")
                 return -1
             # print("simulating corrupted packet")
             # simulate corrupted packet
-            return random.randint(0, 255)
+            return self.random.randint(0, 255)
         
         return b
\ No newline at end of file
@@ -3,10 +3,11 @@ This program is used to update the firmware of the MyActuator using Ymodem proto
 """
 
 from .streams import StreamAbstract
+from .hot_log import HotLog, PacketEventRing
 
 import logging
 import logzero
-import time
+from collections import deque
 from tqdm import tqdm
 
 log_format = "%(color)s[%(levelname)s]%(end_color)s %(message)s"
@@ -40,6 +41,98 @@ def cal_crc16(data: bytes) -> int:
     return crc & 0xffff
 
 
+class TransferStats:
+    """
+    Counters collected during a single transfer.
+    """
+
+    def __init__(self) -> None:
+        self.packets_sent = 0
+        self.retransmissions = 0
+        self.timeouts = 0
+        self.block_size_switches = 0
+        self.block_sizes = {}   # data length -> number of data blocks acknowledged
+
+    def record_block(self, data_len: int) -> None:
+        self.block_sizes[data_len] = self.block_sizes.get(data_len, 0) + 1
+
+    def __repr__(self) -> str:
+        return (f"TransferStats(packets_sent={self.packets_sent}, retransmissions={self.retransmissions}, "
+                f"timeouts={self.timeouts}, block_sizes={self.block_sizes}, "
+                f"block_size_switches={self.block_size_switches})")
+
+
+class BlockSizePolicy:
+    """
+    Always use the same block size. This is the default behaviour of the Ymodem sender.
+    """
+
+    def __init__(self, block_size: int = 1024) -> None:
+        if block_size not in (128, 1024):
+            raise ValueError("Block size must be 128 or 1024.")
+        self.block_size = block_size
+
+    def record(self, success: bool, packet_len: int) -> bool:
+        """
+        Record the outcome of one packet transmission attempt.
+        :param success: True if the packet was ACKed, False on NAK.
+        :param packet_len: number of bytes on the wire for this attempt.
+        :return: True if the block size changed.
+        """
+        return False
+
+
+class AdaptiveBlockSizePolicy(BlockSizePolicy):
+    """
+    Switch between 128 byte (SOH) and 1024 byte (STX) blocks depending on the observed error rate.
+
+    The per-byte error probability is estimated from the NAK rate over a sliding window of recent
+    attempts. The expected goodput of a block of n data bytes is
+
+        n / (n + overhead) * (1 - p) ^ (n + NON_DATA_LEN)
+
+    where overhead covers the packet header, CRC and the ACK turnaround. The policy switches to the
+    other size only when its expected goodput is higher by the hysteresis margin, and only after
+    min_samples attempts since the last switch. The margin is absolute and must stay below the
+    goodput difference of the two sizes on a clean line (about 0.08), otherwise the policy can
+    never return to 1024 byte blocks once the errors stop.
+    """
+
+    def __init__(self, block_size: int = 1024, window: int = 32, min_samples: int = 8,
+                 hysteresis: float = 0.02, turnaround_overhead: int = 8) -> None:
+        super().__init__(block_size)
+        self.window = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.hysteresis = hysteresis
+        self.turnaround_overhead = turnaround_overhead
+
+    def byte_error_rate(self) -> float:
+        attempted_bytes = sum(n for _, n in self.window)
+        if attempted_bytes == 0:
+            return 0.0
+        failures = sum(1 for ok, _ in self.window if not ok)
+        return min(1.0, failures / attempted_bytes)
+
+    def expected_goodput(self, block_size: int, byte_error_rate: float) -> float:
+        packet_len = block_size + Ymodem.NON_DATA_LEN
+        efficiency = block_size / (packet_len + self.turnaround_overhead)
+        return efficiency * (1.0 - byte_error_rate) ** packet_len
+
+    def record(self, success: bool, packet_len: int) -> bool:
+        self.window.append((success, packet_len))
+        if len(self.window) < self.min_samples:
+            return False
+
+        p = self.byte_error_rate()
+        other = 128 if self.block_size == 1024 else 1024
+        if self.expected_goodput(other, p) > self.expected_goodput(self.block_size, p) + self.hysteresis:
+            Logger.info(f"Switching block size {self.block_size} -> {other} (byte error rate {p:.2e}).")
+            self.block_size = other
+            self.window.clear()
+            return True
+        return False
+
+
 class Ymodem:
 
     SOH = 0x01
@@ -53,13 +146,36 @@ class Ymodem:
     NON_DATA_LEN = 5
     DATA_LEN = {SOH: 128, STX: 1024}
 
-    def __init__(self, stream: StreamAbstract) -> None:
+    def __init__(self, stream: StreamAbstract, block_policy: BlockSizePolicy = None, event_ring: PacketEventRing = None) -> None:
 
         if not isinstance(stream, StreamAbstract):
             raise TypeError("stream must be an instance of StreamAbstract.")
         
         self.stream: StreamAbstract = stream
-        self.retransmission_count = 0
+        self.clock = stream.clock
+        self.block_policy = block_policy if block_policy is not None else BlockSizePolicy()
+        self.stats = TransferStats()
+        self.log = HotLog(Logger)
+        self.event_ring = event_ring
+        self.progress_callback = None   # called with (bytes sent, file size) after each data block
+        self.last_data_packet = None    # last data packet of the previous file received, see initiate_recv
+
+    @property
+    def retransmission_count(self) -> int:
+        return self.stats.retransmissions
+
+    def record_attempt(self, packet: bytes, success: bool) -> None:
+        if packet[0] != Ymodem.SOH and packet[0] != Ymodem.STX:
+            return
+        if self.block_policy.record(success, len(packet)):
+            self.stats.block_size_switches += 1
+
+    def dump_events(self) -> None:
+        """
+        Log the recorded packet events, if an event ring was given. Called when a transfer fails.
+        """
+        if self.event_ring is not None:
+            self.event_ring.dump(Logger)
 
     def compute_crc(self, data_bytes) -> int:
         checksum = cal_crc16(data_bytes) & 0xffff
@@ -87,7 +203,7 @@ class Ymodem:
         packet.append(0xFF - packet_number) # 1's complement of packet number
 
         padding_bytes_num = Ymodem.DATA_LEN[packet_type] - len(data)
-        padding_bytes = bytes([0x1A] * padding_bytes_num)
+        padding_bytes = b"\x1a" * padding_bytes_num
         data_bytes = data + padding_bytes
         packet.extend(data_bytes)           # data
 
@@ -106,16 +222,16 @@ class Ymodem:
         if packet[0] == Ymodem.SOH or packet[0] == Ymodem.STX:
             
             if len(packet) != Ymodem.DATA_LEN[packet[0]] + Ymodem.NON_DATA_LEN:
-                Logger.debug("Invalid packet. Packet length is incorrect.")
+                self.log.limited(logging.DEBUG, "Invalid packet. Packet length is incorrect.")
                 return False
 
             if packet[1] + packet[2] != 0xFF:
-                Logger.debug("Invalid packet. Packet number and its complement do not match.")
+                self.log.limited(logging.DEBUG, "Invalid packet. Packet number and its complement do not match.")
                 return False
             
             checksum = self.compute_crc(packet[3:-2])
             if checksum != int.from_bytes(packet[-2:], byteorder='big'):
-                Logger.debug("Invalid packet. Checksum does not match.")
+                self.log.limited(logging.DEBUG, "Invalid packet. Checksum does not match.")
                 return False
         
         return True
@@ -126,25 +242,35 @@ class Ymodem:
         if (not self.is_packet_valid(packet)):
             raise ValueError("Invalid packet.")
         
-        start_time = time.time()
+        block = packet[1] if len(packet) > 1 else 0
+        start_time = self.clock.time()
         while True:
 
-            if timeout > 0 and time.time() - start_time > timeout:
-                Logger.debug("Timeout while waiting for response.")
+            if timeout > 0 and self.clock.time() - start_time > timeout:
+                self.log.debug("Timeout while waiting for response.")
                 return False
 
             # clear the receive buffer before sending the packet.
-            while self.stream.recv_byte() != -1:
-                pass
+            self.stream.clear_recv_buffer()
 
             self.stream.send(packet)
+            self.stats.packets_sent += 1
+            if self.event_ring is not None:
+                self.event_ring.record(PacketEventRing.SENT, block, len(packet))
             response = self.stream.wait_recv_byte(timeout)
+            if self.event_ring is not None:
+                self.event_ring.record(PacketEventRing.ACK if response == Ymodem.ACK else
+                                       PacketEventRing.NAK if response == Ymodem.NAK else
+                                       PacketEventRing.CANCEL if response == Ymodem.CAN else
+                                       PacketEventRing.TIMEOUT, block, response & 0xFFFF)
             if response == Ymodem.ACK:
-                Logger.debug("Received ACK.")
+                self.log.debug("Received ACK.")
+                self.record_attempt(packet, True)
                 return True
             elif response == Ymodem.NAK:
-                self.retransmission_count += 1
-                Logger.debug("Received NAK.")
+                self.stats.retransmissions += 1
+                self.record_attempt(packet, False)
+                self.log.limited(logging.DEBUG, "Received NAK.")
             elif response == Ymodem.CAN:
                 cancel_packet_count = 1
                 for i in range(1):
@@ -157,7 +283,9 @@ class Ymodem:
                     raise ConnectionError("Transfer canceled by the receiver.")
                 
             elif response == -1:
-                Logger.debug("Timeout while waiting for response.")
+                # the transfer fails on a timeout, so it is not fed to the block policy.
+                self.log.debug("Timeout while waiting for response.")
+                self.stats.timeouts += 1
                 return False
 
     
@@ -176,6 +304,9 @@ class Ymodem:
     
     def parse_final_packet(self) -> bool:
         return bytes([Ymodem.EOT])
+
+    def parse_end_of_batch_packet(self) -> bytes:
+        return self.parse_data_packet(0, bytes(128))
     
     def wait_for_request(self, timeout) -> bool:
         return self.stream.try_wait_for_byte(Ymodem.C, timeout)
@@ -185,25 +316,72 @@ class Ymodem:
         Send the file using Ymodem protocol.
         This function does not trigger the transfer.
         It waits for the receiver to send the initial C character.
+        The size of each data block is chosen by the block policy, see self.stats for the sizes used.
 
         :return: True if the transfer was successful, False otherwise.
         """
 
-        self.retransmission_count = 0
+        self.stats = TransferStats()
+        self.log.refresh()
+        if self.event_ring is not None:
+            self.event_ring.clear()
 
         if not self.wait_for_request(1.0):
             Logger.error("Timeout while waiting for the request.")
             return False
+
+        return self.send_file(filename, file_data, show_bar)
+
+    def send_batch(self, files: list, show_bar: bool = False) -> bool:
+        """
+        Send several files in one Ymodem batch session.
+        Each file is requested by the receiver with a C character, the batch is closed with an empty header packet.
+
+        :param files: list of (filename, file_data) tuples.
+        :return: True if all the files were sent, False otherwise.
+        """
+
+        self.stats = TransferStats()
+        self.log.refresh()
+        if self.event_ring is not None:
+            self.event_ring.clear()
+
+        for i, (filename, file_data) in enumerate(files):
+            if not self.wait_for_request(1.0 if i == 0 else 5.0):
+                Logger.error("Timeout while waiting for the request.")
+                return False
+
+            Logger.info(f"Sending {filename} ({i + 1}/{len(files)}).")
+            if not self.send_file(filename, file_data, show_bar):
+                return False
+
+        if not self.wait_for_request(5.0):
+            Logger.error("Timeout while waiting for the end of batch request.")
+            return False
+
+        if not self.serve_packet(self.parse_end_of_batch_packet()):
+            Logger.error("Failed to send the end of batch packet.")
+            self.dump_events()
+            return False
+
+        Logger.info("Batch transfer completed.")
+        return True
+
+    def send_file(self, filename, file_data: bytes, show_bar: bool = False) -> bool:
+        """
+        Send one file, from the header packet to the final EOT.
+        The receiver must already have requested the transfer with a C character.
+        """
         
         initiate_transfer_packet = self.parse_initial_packet(filename, len(file_data))
         if not self.serve_packet(initiate_transfer_packet):
             Logger.error("Failed to send the initial packet.")
+            self.dump_events()
             return False
         
         
-        chunk_size = 1024
-        total_chunks = (len(file_data) + chunk_size - 1) // chunk_size
-        chunk_num = 0
+        offset = 0
+        block_num = 1
 
         # wait for second handshake
         if not self.stream.try_wait_for_byte(Ymodem.C, 5.0):
@@ -211,25 +389,29 @@ class Ymodem:
             return False
 
         with tqdm(total=len(file_data), disable=(not show_bar), unit="Byte") as pbar:
-            while True:
+            while offset < len(file_data):
 
-                if chunk_num > total_chunks:
-                    break
-
-                packet = self.parse_data_packet(chunk_num + 1, file_data[chunk_num * chunk_size: (chunk_num + 1) * chunk_size])
+                chunk = file_data[offset: offset + self.block_policy.block_size]
+                packet = self.parse_data_packet(block_num, chunk)
 
                 if not self.serve_packet(packet):
                     Logger.error("Failed to send packet.")
+                    self.dump_events()
                     return False
                 
-                pbar.update(len(file_data[chunk_num * chunk_size: (chunk_num + 1) * chunk_size]))
-                chunk_num += 1
+                self.stats.record_block(Ymodem.DATA_LEN[packet[0]])
+                pbar.update(len(chunk))
+                offset += len(chunk)
+                block_num += 1
+                if self.progress_callback is not None:
+                    self.progress_callback(offset, len(file_data))
                 
 
         # send the final packet
         final_packet = self.parse_final_packet()
         if not self.serve_packet(final_packet):
             Logger.error("Failed to send the final packet.")
+            self.dump_events()
             return False
         
         Logger.info("File transfer completed.")
@@ -238,11 +420,11 @@ class Ymodem:
     def try_recv_packet(self, timeout) -> bytes:
 
         single_byte_packets = [Ymodem.EOT, Ymodem.ACK, Ymodem.NAK, Ymodem.CAN, Ymodem.C]
-        start_time = time.time()
+        start_time = self.clock.time()
         while True:
 
-            if timeout > 0 and time.time() - start_time > timeout:
-                Logger.debug("Timeout while waiting for response.")
+            if timeout > 0 and self.clock.time() - start_time > timeout:
+                self.log.debug("Timeout while waiting for response.")
                 return None
 
             header = self.stream.wait_recv_byte()
@@ -257,7 +439,7 @@ class Ymodem:
             elif header == Ymodem.STX:
                 expected_bytes_num = Ymodem.DATA_LEN[Ymodem.STX] + Ymodem.NON_DATA_LEN
             else:
-                Logger.debug(f"Invalid packet header. {header}")
+                self.log.limited(logging.DEBUG, "Invalid packet header. %d", header)
                 expected_bytes_num = Ymodem.DATA_LEN[Ymodem.SOH] + Ymodem.NON_DATA_LEN # clears the recv buffer.
 
             packet = bytearray()
@@ -273,6 +455,14 @@ class Ymodem:
             
             return None
             
+    def purge(self, quiet: float = 0.02) -> None:
+        """
+        Discard incoming bytes until the line has been quiet for the given time,
+        so the rest of a broken packet is not parsed as new packets.
+        """
+        while self.stream.wait_recv_byte(quiet) != -1:
+            pass
+
     def initiate_recv(self):
         # initiate transfer.
         self.stream.send(bytes([Ymodem.C]))
@@ -282,20 +472,49 @@ class Ymodem:
             if initial_packet is None:
                 Logger.warn("Failed to receive the initial packet.")
                 self.stream.send(bytes([Ymodem.NAK]))
-                time.sleep(1)
-            else:
-                break
+                self.clock.sleep(1)
+            elif initial_packet[0] == Ymodem.EOT:
+                # the sender missed our ACK of the previous file's EOT, it dropped our C as well.
+                self.stream.send(bytes([Ymodem.ACK, Ymodem.C]))
+            elif initial_packet == self.last_data_packet:
+                # the sender missed our ACK of the previous file's last block.
+                self.stream.send(bytes([Ymodem.ACK]))
+            elif len(initial_packet) > 1 and initial_packet[1] == 0:
+                try:
+                    header = self.parse_header(initial_packet)
+                    break
+                except ValueError:
+                    self.log.limited(logging.DEBUG, "Malformed header packet. NAK sent.")
+                    self.stream.send(bytes([Ymodem.NAK]))
+            # any other data block is stale, e.g. a group packet sent while we missed the header.
 
         self.stream.send(bytes([Ymodem.ACK]))
-        filename = initial_packet[3:initial_packet.find(0, 3)].decode('ascii')
-        filesize = int(initial_packet[initial_packet.find(0, 3)+1:initial_packet.find(0, initial_packet.find(0, 3)+1)].decode('ascii'))
+        self.last_data_packet = None
+        return header
+
+    def parse_header(self, packet: bytes) -> tuple:
+        """
+        Filename and size of a header packet, ("", 0) for the empty header closing a batch.
+        Raises ValueError if the packet is not a valid header.
+        """
+        if packet[3] == 0:
+            return "", 0
+        name_end = packet.find(0, 3)
+        size_end = packet.find(0, name_end + 1)
+        if name_end == -1 or size_end == -1:
+            raise ValueError("Header is not null terminated.")
+        filename = packet[3:name_end].decode('ascii')
+        filesize = int(packet[name_end + 1:size_end].decode('ascii'))
+        if filesize < 0:
+            raise ValueError("Negative file size.")
         return filename, filesize
         
     
     def recv(self, filesize: int = 0, show_bar = False) -> bytes:
 
         file_data = bytearray()
-        chunk_num = 0
+        chunk_num = 1 # block 0 is the initial packet, see initiate_recv.
+        self.log.refresh()
 
         self.stream.send(bytes([Ymodem.C])) # send the second handshake
 
@@ -304,11 +523,19 @@ class Ymodem:
 
                 packet = self.try_recv_packet(0.2)
                 if packet is None:
-                    Logger.debug("Failed to receive the packet. NAK sent.")
+                    self.purge()
+                    self.log.limited(logging.DEBUG, "Failed to receive the packet. NAK sent.")
+                    if self.event_ring is not None:
+                        self.event_ring.record(PacketEventRing.RECV_INVALID, chunk_num % 256)
                     self.stream.send(bytes([Ymodem.NAK]))
                     continue
 
                 if packet[0] == Ymodem.EOT:
+                    if len(file_data) < filesize:
+                        # a corrupted byte, the file is not complete yet.
+                        self.log.limited(logging.DEBUG, "EOT before the end of the file. NAK sent.")
+                        self.stream.send(bytes([Ymodem.NAK]))
+                        continue
                     self.stream.send(bytes([Ymodem.ACK]))
                     break
 
@@ -316,7 +543,7 @@ class Ymodem:
                     cancel_packet_count = 1
                     for i in range(1):
                         packet = self.try_recv_packet(0.1)
-                        if packet[0] == Ymodem.CAN:
+                        if packet is not None and packet[0] == Ymodem.CAN:
                             cancel_packet_count += 1
                         else:
                             break
@@ -327,14 +554,24 @@ class Ymodem:
 
                 if packet[0] == Ymodem.SOH or packet[0] == Ymodem.STX:
 
+                    if packet[1] == (chunk_num - 1) % 256:
+                        # our ACK for the previous block was lost, acknowledge it again.
+                        self.stream.send(bytes([Ymodem.ACK]))
+                        continue
+
                     if packet[1] != chunk_num % 256:
-                        Logger.debug(f"Invalid chunk number. Expected: {chunk_num}, Received: {packet[1]}. NAK sent.")
+                        self.log.limited(logging.DEBUG, "Invalid chunk number. Expected: %d, Received: %d. NAK sent.", chunk_num, packet[1])
+                        if self.event_ring is not None:
+                            self.event_ring.record(PacketEventRing.RECV_OUT_OF_ORDER, packet[1], chunk_num % 256)
                         self.stream.send(bytes([Ymodem.NAK]))
                         continue
                     
                     file_data.extend(packet[3:-2])
+                    self.last_data_packet = packet
                     self.stream.send(bytes([Ymodem.ACK]))
-                    Logger.debug(f"Received chunk {chunk_num}. ACK sent.")
+                    self.log.debug("Received chunk %d. ACK sent.", chunk_num)
+                    if self.event_ring is not None:
+                        self.event_ring.record(PacketEventRing.RECV_OK, packet[1], len(packet))
                     chunk_num += 1
                     if len(file_data) < filesize:
                         pbar.update(len(packet[3:-2]))
@@ -347,5 +584,20 @@ class Ymodem:
         Logger.debug("File transfer completed.")
         return file_data
     
+    def recv_batch(self, show_bar = False) -> list:
+        """
+        Receive files until the sender closes the batch with an empty header packet.
+        :return: list of (filename, file_data) tuples.
+        """
+        files = []
+        while True:
+            filename, filesize = self.initiate_recv()
+            if filename == "":
+                break
+            Logger.info(f"Receiving {filename} with size {filesize}.")
+            files.append((filename, self.recv(filesize, show_bar)))
+        Logger.debug("Batch transfer completed.")
+        return files
+
     def cancel_transfer(self):
         self.stream.send(bytes([Ymodem.CAN]*2))
\ No newline at end of file
@@ -0,0 +1,111 @@
+from mcfs_tools.ymodem import Ymodem, Logger
+from mcfs_tools.fleet import FleetJob, FleetScheduler, ThroughputHistory, load_manifest
+from mcfs_tools.streams.socketcan_stream import SocketCanStream
+import argparse
+import can
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+def simulated_motor(channel: str, motor_id: int, batch: bool, received: dict):
+    bus = can.Bus(channel, interface="virtual")
+    stream = SocketCanStream(motor_id, custom_bus=bus)
+    stream.wait_for_ota()
+    ymodem = Ymodem(stream)
+    if batch:
+        received[(channel, motor_id)] = [data for name, data in ymodem.recv_batch()]
+    else:
+        filename, filesize = ymodem.initiate_recv()
+        received[(channel, motor_id)] = [ymodem.recv(filesize)]
+    bus.shutdown()
+
+
+def check_failures_do_not_stall(workdir: str) -> bool:
+    """
+    On a single slot bus, a job whose stream factory raises must not keep the remaining jobs from running.
+    """
+    attempts = []
+
+    def failing_factory(channel, motor_id):
+        attempts.append(motor_id)
+        raise can.CanError("bus off")
+
+    jobs = []
+    for motor_id, name in ((1, "münchen.bin"), (2, "b.bin")):
+        with open(os.path.join(workdir, name), "wb") as f:
+            f.write(bytes(1000))
+        jobs.append(FleetJob("mcfs_fleet_fail", motor_id, [os.path.join(workdir, name)]))
+
+    result = FleetScheduler(jobs, {"mcfs_fleet_fail": 1}, ThroughputHistory(), stream_factory=failing_factory, retries=1).run()
+    if sorted(attempts) != [1, 1, 2, 2] or any(result.values()):
+        print(f"Failed jobs stalled the bus, attempts {attempts}.")
+        return False
+    return True
+
+
+def main(motors_per_channel: int, slots: int, size: int, dry_run: bool):
+
+    Logger.setLevel(logging.INFO)
+    workdir = tempfile.mkdtemp(prefix="mcfs_fleet_")
+    if not dry_run and not check_failures_do_not_stall(workdir):
+        return
+    channels = {"mcfs_fleet_a": {"slots": slots, "motors": {}}, "mcfs_fleet_b": {"motors": {}}}
+    images = {}
+    for c, (channel, config) in enumerate(channels.items()):
+        for motor_id in range(1, motors_per_channel + 1):
+            names = [f"{channel}_{motor_id}.bin"]
+            if motor_id == 1:
+                names.insert(0, f"{channel}_boot.bin")
+            for i, name in enumerate(names):
+                with open(os.path.join(workdir, name), "wb") as f:
+                    f.write(os.urandom(size * motor_id // (4 if i < len(names) - 1 else 1)))
+            config["motors"][str(motor_id)] = names if len(names) > 1 else names[0]
+            images[(channel, motor_id)] = names
+
+    manifest = os.path.join(workdir, "fleet.json")
+    with open(manifest, "w") as f:
+        json.dump({"history": "throughput.json", "channels": channels}, f, indent=4)
+
+    for run in range(2):
+        jobs, slot_counts, history = load_manifest(manifest)
+        scheduler = FleetScheduler(jobs, slot_counts, ThroughputHistory(history),
+                                   stream_factory=lambda channel, motor_id: SocketCanStream(motor_id, custom_bus=can.Bus(channel, interface="virtual")))
+        print(f"Run {run + 1}:")
+        scheduler.print_plan()
+        if dry_run:
+            return
+
+        received = {}
+        threads = [threading.Thread(target=simulated_motor, args=(job.channel, job.motor_id, len(job.filenames) > 1, received), daemon=True)
+                   for job in jobs]
+        for thread in threads:
+            thread.start()
+
+        result = scheduler.run()
+        for job in jobs:
+            expected = []
+            for name in images[(job.channel, job.motor_id)]:
+                with open(os.path.join(workdir, name), "rb") as f:
+                    expected.append(f.read())
+            data_ok = received.get((job.channel, job.motor_id)) == expected
+            print(f"  {job.channel}:{job.motor_id} {'OK' if result[(job.channel, job.motor_id)] else 'FAILED'} "
+                  f"{'data ok' if data_ok else 'data mismatch'}  took {job.duration or 0:.2f} s, estimate {job.estimate:.2f} s")
+        print(f"Makespan {max(job.duration or 0 for job in jobs):.2f} s or more")
+
+    if not all(result.values()):
+        print("failed to flash the fleet")
+        return
+    print("Fleet flashed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Flash a manifest of simulated motors on two virtual CAN buses, twice, so the second plan uses the measured throughput.')
+    parser.add_argument('-n', '--motors', type=int, help='Motors per channel.', default=3)
+    parser.add_argument('--slots', type=int, help='Concurrency slots of the first channel.', default=2)
+    parser.add_argument('-s', '--size', type=int, help='Image size of motor 1, motor n gets n times that.', default=8000)
+    parser.add_argument('--dry_run', action="store_true", help='Only print the plan.')
+    args = parser.parse_args()
+    main(args.motors, args.slots, args.size, args.dry_run)
@@ -0,0 +1,231 @@
+from mcfs_tools.ymodem import Ymodem, Logger
+from mcfs_tools.clock import SimulatedClock
+from mcfs_tools.streams.loopback_stream import LoopbackStream
+from mcfs_tools.streams.socketcan_stream import SocketCanStream
+import argparse
+import can
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import tracemalloc
+
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_budgets.json")
+
+
+def loopback_pair(index: int, clock: SimulatedClock):
+    return LoopbackStream.pair(clock=clock)
+
+
+class VirtualCanStream(SocketCanStream):
+    """
+    SocketCanStream on a python-can virtual bus. The bus delivers in memory, so a send wakes
+    the simulated pollers like a LoopbackStream does.
+    """
+
+    def send(self, data: bytes) -> None:
+        super().send(data)
+        self.clock.notify()
+
+
+def virtual_can_pair(index: int, clock: SimulatedClock):
+    channel = f"mcfs_memory_test_{index}"
+    pair = (VirtualCanStream(index, custom_bus=can.Bus(channel, interface="virtual")),
+            VirtualCanStream(index, custom_bus=can.Bus(channel, interface="virtual")))
+    for stream in pair:
+        stream.clock = clock
+    return pair
+
+
+STREAMS = {"loopback": loopback_pair, "virtualcan": virtual_can_pair}
+
+
+def close_pair(pair) -> None:
+    for stream in pair:
+        if isinstance(stream, SocketCanStream):
+            stream.can_bus.shutdown()
+
+
+def run_sessions(make_pair, files: list, sessions: int = 1, on_packet=None) -> None:
+    """
+    Send files over sessions pairs at once, one batch session each.
+
+    The sessions run in simulated time, so the threads of concurrent sessions cannot starve each
+    other's inter-byte timeouts and a transfer failure is a protocol error, not scheduling noise.
+    It is raised as RuntimeError, apart from the budget verdict.
+    """
+    clock = SimulatedClock(limit=600)
+    pairs = [make_pair(i, clock) for i in range(sessions)]
+    tasks = []
+    for sender_stream, receiver_stream in pairs:
+        sender, receiver = Ymodem(sender_stream), Ymodem(receiver_stream)
+        if on_packet is not None:
+            serve_packet = sender.serve_packet
+            sender.serve_packet = lambda packet, timeout=5.0, serve_packet=serve_packet: on_packet(serve_packet, packet, timeout)
+        tasks += [lambda sender=sender: sender.send_batch(files), receiver.recv_batch]
+
+    try:
+        results = clock.run(*tasks)
+    except TimeoutError:
+        results = [False, None] * sessions
+    finally:
+        for pair in pairs:
+            close_pair(pair)
+    for i in range(sessions):
+        if not results[2 * i] or results[2 * i + 1] != files:
+            raise RuntimeError(f"transfer failed in session {i}")
+
+
+def current_rss_kib() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def measure_packet_peak(make_pair, files: list) -> tuple:
+    """
+    Median over the packets of a session, both ends included.
+    :return: peak traced bytes allocated while one packet is served,
+        number of memory blocks still allocated after serving one packet (snapshot statistics).
+        Temporaries freed within the packet do not show in the block count, only in the peak bytes;
+        tracemalloc has no count of the allocations made.
+    """
+    peaks = []
+    blocks = []
+    own_allocations = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+    def on_packet(serve_packet, packet, timeout):
+        snapshot = tracemalloc.take_snapshot().filter_traces(own_allocations)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        ok = serve_packet(packet, timeout)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        after = tracemalloc.take_snapshot().filter_traces(own_allocations)
+        blocks.append(sum(stat.count_diff for stat in after.compare_to(snapshot, "filename")))
+        return ok
+
+    run_sessions(make_pair, files, on_packet=on_packet)
+    return sorted(peaks)[len(peaks) // 2], sorted(blocks)[len(blocks) // 2]
+
+
+def measure_sessions(make_pair, files: list, sessions: int) -> tuple:
+    """
+    Run concurrent sessions. The peak RSS is sampled while they run, ru_maxrss would only count
+    the growth above the high-water mark of everything that ran before in the process.
+    :return: peak traced bytes per session, peak RSS increase per session in KiB.
+    """
+    gc.collect()
+    rss_before = current_rss_kib()
+    rss_peak = [rss_before]
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(0.001):
+            rss_peak[0] = max(rss_peak[0], current_rss_kib())
+
+    sampler = threading.Thread(target=sample_rss)
+    sampler.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+
+    try:
+        run_sessions(make_pair, files, sessions)
+    finally:
+        done.set()
+        sampler.join()
+
+    peak = tracemalloc.get_traced_memory()[1] - before
+    rss = max(rss_peak[0], current_rss_kib()) - rss_before
+    return peak / sessions, rss / sessions
+
+
+def measure_growth(make_pair, files: list, runs: int) -> int:
+    """
+    Traced memory still held after runs multi image sessions, compared to after the second one.
+    """
+    baseline = None
+    for i in range(runs):
+        run_sessions(make_pair, files)
+        gc.collect()
+        if i == 1:
+            baseline = tracemalloc.get_traced_memory()[0]
+    return tracemalloc.get_traced_memory()[0] - baseline
+
+
+def measure(name: str, size: int, sessions: int, runs: int) -> dict:
+    """
+    All the metrics of one stream type. Called in a fresh process per stream type, see main.
+    The packet measurement runs first and warms up the code paths, so the session figures are the
+    same whatever was measured before.
+    """
+    Logger.setLevel(logging.WARNING)
+    files = [("boot.bin", os.urandom(size // 4)), ("app.bin", os.urandom(size))]
+    make_pair = STREAMS[name]
+
+    tracemalloc.start()
+    results = {}
+    results["packet_peak_bytes"], results["packet_retained_blocks"] = measure_packet_peak(make_pair, files)
+    results["session_peak_bytes"], results["session_rss_kib"] = measure_sessions(make_pair, files, sessions)
+    results["growth_bytes"] = measure_growth(make_pair, files, runs)
+    tracemalloc.stop()
+    return results
+
+
+def main(stream_names: list, size: int, sessions: int, runs: int, update: bool):
+
+    with open(BUDGET_FILE) as f:
+        budgets = json.load(f)
+
+    failed = False
+    broken = []
+    for name in stream_names:
+        # one process per stream type, so the RSS figures do not depend on what was measured before.
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name, "-s", str(size),
+                                "--sessions", str(sessions), "--runs", str(runs)],
+                               stdout=subprocess.PIPE, text=True)
+        if child.returncode != 0:
+            # a failed transfer says nothing about the memory footprint, it is reported apart.
+            print(f"{name:12s} transfer failed, not measured")
+            broken.append(name)
+            continue
+        results = json.loads(child.stdout.splitlines()[-1])
+
+        for metric, value in results.items():
+            budget = budgets.get(name, {}).get(metric)
+            status = ""
+            if budget is not None and value > budget:
+                status = "OVER BUDGET"
+                failed = True
+            print(f"{name:12s} {metric:24s} {value:12.0f}  budget {budget}  {status}")
+
+        if update:
+            budgets[name] = {metric: int(value * 1.5) + (16 if metric == "packet_retained_blocks" else 1024)
+                             for metric, value in results.items()}
+
+    if broken:
+        print(f"Transfer failed on {', '.join(broken)}.")
+        exit(2)
+    if update:
+        with open(BUDGET_FILE, "w") as f:
+            json.dump(budgets, f, indent=4)
+        print("Budgets updated.")
+    elif failed:
+        print("Memory budget exceeded.")
+        exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Allocation and memory footprint benchmark of the Ymodem send/recv loops.')
+    parser.add_argument('--streams', type=str, help='Comma separated stream types.', default=",".join(STREAMS))
+    parser.add_argument('-s', '--size', type=int, help='Size of the application image.', default=32768)
+    parser.add_argument('--sessions', type=int, help='Number of concurrent sessions.', default=4)
+    parser.add_argument('--runs', type=int, help='Number of multi image sessions for the growth check.', default=10)
+    parser.add_argument('--update', action="store_true", help='Store the measured values (with margin) as the new budgets.')
+    parser.add_argument('--child', type=str, help='Measure this stream type and print the results as JSON (used by the parent process).', default=None)
+    args = parser.parse_args()
+    if args.child is not None:
+        print(json.dumps(measure(args.child, args.size, args.sessions, args.runs)))
+    else:
+        main(args.streams.split(","), args.size, args.sessions, args.runs, args.update)
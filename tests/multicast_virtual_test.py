@@ -0,0 +1,107 @@
+from mcfs_tools.ymodem import Ymodem
+from mcfs_tools.multicast import MulticastYmodem
+from mcfs_tools.streams.socketcan_stream import SocketCanStream
+from mcfs_tools.streams.fault_injection_stream import FaultInjectionStream, FaultInjector, BernoulliFaults
+import argparse
+import can
+import os
+import sys
+import threading
+
+
+CHANNEL = "mcfs_multicast_test"
+MAX_REPAIRS = 3
+HEADER_FRAMES = 17      # 133 byte header packet in 8 byte frames
+
+
+class LeadingFaults:
+    """
+    Fault model hitting the first count units and nothing after them.
+    """
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+
+    def gaps(self, injector: FaultInjector, n: int) -> list:
+        gaps = [1] * min(self.count, n) + [sys.maxsize] * max(n - self.count, 0)
+        self.count = max(self.count - n, 0)
+        return gaps
+
+
+def simulated_motor(motor_id: int, group_id: int, loss: float, header_fault: str, received: dict):
+    """
+    Bootloader emulation: a Ymodem receiver that accepts frames for its own id and the group id.
+
+    header_fault "miss": the motor loses every multicast of the header packet, leaves the group at the
+    header step and is finished by unicast.
+    header_fault "lose": the motor also never hears its own id, so the unicast header fails and the
+    host cancels it. It then sees every group block while waiting for a header and must take none of them.
+    """
+    node_ids = {"miss": (motor_id, group_id), "lose": (group_id, )}.get(header_fault)
+    if node_ids is not None:
+        # Filter on the bus, so only the frames addressed to this motor count towards the lost ones.
+        filters = [{"can_id": node_id << 6, "can_mask": 0x1F << 6} for node_id in node_ids]
+        bus = can.Bus(CHANNEL, interface="virtual", can_filters=filters)
+    else:
+        bus = can.Bus(CHANNEL, interface="virtual")
+    stream = SocketCanStream(motor_id, custom_bus=bus)
+    stream.add_listen_id(group_id)
+    if node_ids is not None:
+        lost = (MAX_REPAIRS + 1) * HEADER_FRAMES
+        stream = FaultInjectionStream(stream, rx=FaultInjector(LeadingFaults(lost), granularity=8))
+    elif loss > 0:
+        stream = FaultInjectionStream(stream, rx=FaultInjector(BernoulliFaults(loss), granularity=8, seed=motor_id))
+    ymodem = Ymodem(stream)
+    filename, filesize = ymodem.initiate_recv()
+    received[motor_id] = ymodem.recv(filesize)
+    bus.shutdown()
+
+
+def main(motor_ids: list, group_id: int, size: int, loss: float, miss_header: int, lose_header: int):
+
+    data = os.urandom(size)
+    received = {}
+    header_faults = {miss_header: "miss", lose_header: "lose"}
+
+    host_bus = can.Bus(CHANNEL, interface="virtual")
+    threads = {m: threading.Thread(target=simulated_motor, args=(m, group_id, loss, header_faults.get(m), received), daemon=True)
+               for m in motor_ids}
+    for thread in threads.values():
+        thread.start()
+
+    session = MulticastYmodem(host_bus, motor_ids, group_id, max_repairs=MAX_REPAIRS)
+    result = session.send("multicast.bin", data, show_bar=True)
+    for m, thread in threads.items():
+        if m != lose_header:
+            thread.join(5.0)
+    host_bus.shutdown()
+
+    for motor in session.motors.values():
+        state = "no file" if motor.motor_id not in received else "data ok" if received[motor.motor_id] == data else "data mismatch"
+        print(motor, state)
+
+    expected = [m for m in motor_ids if m != lose_header]
+    if not all(result[m] for m in expected) or any(received.get(m) != data for m in expected):
+        print("failed to send file")
+        exit(1)
+    if miss_header in session.motors and session.motors[miss_header].dropped_at != 1:
+        print(f"Motor {miss_header} did not leave the group at the header step.")
+        exit(1)
+    if lose_header in session.motors:
+        if result[lose_header] or not threads[lose_header].is_alive() or lose_header in received:
+            print(f"Motor {lose_header} took a group block for its header.")
+            exit(1)
+
+    print("File transfer completed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Multicast a file to simulated motors on a virtual CAN bus.')
+    parser.add_argument('--ids', type=str, help='Comma separated motor ids.', default="1,2,3,4")
+    parser.add_argument('--group_id', type=int, help='Group id accepted by every motor.', default=31)
+    parser.add_argument('-s', '--size', type=int, help='Size of the random file to send.', default=20000)
+    parser.add_argument('-l', '--loss', type=float, help='Frame loss probability at each motor.', default=0.002)
+    parser.add_argument('--miss_header', type=int, help='Motor that loses every multicast of the header and catches up by unicast, 0 for none.', default=3)
+    parser.add_argument('--lose_header', type=int, help='Motor that never receives the header and must not start on a data block, 0 for none.', default=4)
+    args = parser.parse_args()
+    main([int(i) for i in args.ids.split(",")], args.group_id, args.size, args.loss, args.miss_header, args.lose_header)
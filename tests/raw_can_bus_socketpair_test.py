@@ -0,0 +1,129 @@
+from mcfs_tools.streams.raw_can_bus import RawSocketCanBus, CAN_EFF_FLAG, CAN_RTR_FLAG, CAN_ERR_FLAG
+from mcfs_tools.streams.socketcan_stream import SocketCanStream
+import argparse
+import can
+import socket
+import time
+
+
+def pack_frame(can_id: int, data: bytes) -> bytes:
+    return RawSocketCanBus.FRAME.pack(can_id, len(data), data)
+
+
+def open_pair(batch_size: int):
+    """
+    A RawSocketCanBus on one end of an AF_UNIX datagram socketpair, the other end plays the CAN bus.
+    Each datagram is one struct can_frame, as on a raw AF_CAN socket.
+    """
+    peer, sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    return peer, RawSocketCanBus("unused", batch_size=batch_size, sock=sock)
+
+
+def check_batch(frames: int, batch_size: int) -> bool:
+    peer, bus = open_pair(batch_size)
+    sent = [(i << 6 | 1, bytes((i + j) & 0xFF for j in range(i % 9))) for i in range(frames)]
+    before = time.time()
+    for can_id, data in sent:
+        peer.send(pack_frame(can_id, data))
+
+    received, timestamps = [], []
+    while True:
+        count = bus.recv_batch(0.05)
+        if count == 0:
+            break
+        if count > batch_size:
+            print(f"recv_batch returned {count} frames, more than the batch size {batch_size}.")
+            return False
+        received += [(can_id, bytes(data[:dlc])) for can_id, dlc, data in bus.frames(count)]
+        timestamps += bus.timestamps[:count]
+    peer.close()
+    bus.shutdown()
+
+    if received != sent:
+        print(f"Unpacked frames differ: sent {len(sent)}, received {len(received)}.")
+        return False
+    if timestamps != sorted(timestamps) or not before - 1 <= timestamps[0] <= time.time():
+        print(f"Implausible timestamps: {timestamps[:3]} ...")
+        return False
+    return True
+
+
+def check_recv_and_send() -> bool:
+    peer, bus = open_pair(4)
+    peer.send(pack_frame(5 << 6 | 1, b"\x01\x02\x03"))
+    peer.send(pack_frame(0x1234567 | CAN_EFF_FLAG, b"\xAA"))
+    msg, ext = bus.recv(0.1), bus.recv(0.1)
+    empty = bus.recv(0.01)
+
+    bus.send(can.Message(arbitration_id=7 << 6 | 1, data=b"abc", is_extended_id=False))
+    can_id, dlc, data = RawSocketCanBus.FRAME.unpack(peer.recv(64))
+    peer.close()
+    bus.shutdown()
+
+    ok = (msg.arbitration_id == 5 << 6 | 1 and bytes(msg.data) == b"\x01\x02\x03" and not msg.is_extended_id
+          and ext.arbitration_id == 0x1234567 and ext.is_extended_id and bytes(ext.data) == b"\xAA"
+          and empty is None and (can_id, dlc, data[:dlc]) == (7 << 6 | 1, 3, b"abc"))
+    if not ok:
+        print(f"recv/send mismatch: {msg}, {ext}, {empty}, {(can_id, dlc, data)}")
+    return ok
+
+
+def check_stream_filter() -> bool:
+    """
+    SocketCanStream.recv_frames keeps only standard data frames addressed to one of its listen ids.
+    """
+    peer, bus = open_pair(8)
+    stream = SocketCanStream(1, custom_bus=bus)
+    frames = [
+        (1 << 6 | 1, b"keep"),
+        (2 << 6 | 1, b"other"),                 # another motor
+        (1 << 6 | 1 | CAN_EFF_FLAG, b"ext"),    # extended id with our node bits
+        (1 << 6 | 1 | CAN_RTR_FLAG, b""),       # remote frame
+        (1 << 6 | 1 | CAN_ERR_FLAG, b"err"),    # error frame
+        (1 << 6 | 3, b"\x00me"),
+    ]
+    before = time.time()
+    for can_id, data in frames:
+        peer.send(pack_frame(can_id, data))
+
+    received = bytearray()
+    while True:
+        byte = stream.wait_recv_byte(0.05)
+        if byte == -1:
+            break
+        received.append(byte)
+    timestamp = stream.last_rx_timestamp
+    peer.close()
+    bus.shutdown()
+
+    if bytes(received) != b"keep\x00me":
+        print(f"Stream received {bytes(received)}, expected {b'keep' + bytes([0]) + b'me'}.")
+        return False
+    if timestamp is None or not before - 1 <= timestamp <= time.time():
+        print(f"Implausible receive timestamp {timestamp}.")
+        return False
+    return True
+
+
+def main(frames: int, batch_size: int):
+
+    checks = [("batched receive", lambda: check_batch(frames, batch_size)),
+              ("recv/send", check_recv_and_send),
+              ("stream filter", check_stream_filter)]
+    failed = False
+    for name, check in checks:
+        ok = check()
+        print(f"{name}: {'ok' if ok else 'FAILED'}")
+        failed = failed or not ok
+
+    if failed:
+        exit(1)
+    print("RawSocketCanBus checks passed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check RawSocketCanBus and the batched SocketCanStream receive path over an AF_UNIX socketpair, no CAN interface needed.')
+    parser.add_argument('-n', '--frames', type=int, help='Frames sent for the batched receive check.', default=200)
+    parser.add_argument('--batch_size', type=int, help='Batch size of the bus.', default=64)
+    args = parser.parse_args()
+    main(args.frames, args.batch_size)
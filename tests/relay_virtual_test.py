@@ -0,0 +1,81 @@
+from mcfs_tools.ymodem import Ymodem
+from mcfs_tools.relay import RelayServer, upload
+from mcfs_tools.streams.socketcan_stream import SocketCanStream
+import argparse
+import can
+import os
+import threading
+import time
+
+
+CHANNEL = "mcfs_relay_test"
+
+
+def simulated_motor(motor_id: int, group_id: int, received: dict):
+    bus = can.Bus(CHANNEL, interface="virtual")
+    stream = SocketCanStream(motor_id, custom_bus=bus)
+    if group_id is not None:
+        stream.add_listen_id(group_id)
+    stream.wait_for_ota()
+    ymodem = Ymodem(stream)
+    filename, filesize = ymodem.initiate_recv()
+    received[motor_id] = ymodem.recv(filesize)
+    bus.shutdown()
+
+
+def main(motor_ids: list, port: int, size: int, group_id: int):
+
+    data = os.urandom(size)
+    received = {}
+    events = []
+
+    motors = [threading.Thread(target=simulated_motor, args=(m, group_id, received), daemon=True) for m in motor_ids]
+    for motor in motors:
+        motor.start()
+
+    relay = RelayServer(port, stream_factory=lambda motor_id: SocketCanStream(motor_id, custom_bus=can.Bus(CHANNEL, interface="virtual")),
+                        bus_factory=lambda: can.Bus(CHANNEL, interface="virtual"), progress_interval=0.05)
+    relay_thread = threading.Thread(target=lambda: (relay.serve_once(), relay.serve_once()))
+    relay_thread.start()
+    time.sleep(0.5)
+
+    # a filename that does not fit a Ymodem header is rejected, the relay keeps serving.
+    try:
+        upload("localhost", port, "prošivka.bin", data, motor_ids)
+        print("Relay accepted a non-ASCII filename.")
+        return
+    except ConnectionError as e:
+        print("Rejected:", e)
+    time.sleep(0.5)
+
+    start = time.time()
+    result = upload("localhost", port, "relay.bin", data, motor_ids, group_id, on_event=lambda e: (print(e), events.append(e)))
+    relay_thread.join()
+    print(f"Relay transfer took {time.time() - start:.2f} s")
+    # the relay reports success on the final ACK, the motors may still be storing the file.
+    for motor in motors:
+        motor.join(5.0)
+
+    for motor_id in motor_ids:
+        print(f"Motor {motor_id}:", "data ok" if received.get(motor_id) == data else "data mismatch")
+
+    if not all(result.values()) or any(received.get(m) != data for m in motor_ids):
+        print("failed to send file")
+        return
+
+    # progress events keep the client from timing out during long transfers, for groups as well.
+    if not any(e["event"] == "progress" for e in events):
+        print("The relay sent no progress events.")
+        return
+
+    print("File transfer completed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Flash simulated motors on a virtual CAN bus through the relay.')
+    parser.add_argument('--ids', type=str, help='Comma separated motor ids.', default="1,2")
+    parser.add_argument('-p', '--port', type=int, help='Relay port.', default=5007)
+    parser.add_argument('-s', '--size', type=int, help='Size of the random file to send.', default=20000)
+    parser.add_argument('-g', '--group_id', type=int, help='Flash the motors as a group through this group id.', default=None)
+    args = parser.parse_args()
+    main([int(i) for i in args.ids.split(",")], args.port, args.size, args.group_id)
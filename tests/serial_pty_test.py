@@ -0,0 +1,74 @@
+from mcfs_tools import Ymodem
+from mcfs_tools.streams import StreamAbstract
+from mcfs_tools.streams.serial_stream import SerialStream
+import argparse
+import os
+import threading
+import tty
+
+
+class PtyMasterStream(StreamAbstract):
+    """
+    The other end of the pty, read and written through the master file descriptor.
+    """
+
+    def __init__(self, fd: int) -> None:
+        super().__init__()
+        self.fd = fd
+        self.recv_buffer = b""
+        self.recv_pos = 0
+        os.set_blocking(fd, False)
+
+    def recv_byte(self) -> int:
+        if self.recv_pos < len(self.recv_buffer):
+            byte = self.recv_buffer[self.recv_pos]
+            self.recv_pos += 1
+            return byte
+        try:
+            self.recv_buffer = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return -1
+        self.recv_pos = 0
+        return self.recv_byte() if self.recv_buffer else -1
+
+    def send(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                continue
+
+
+def main(size: int, baudrate: int):
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    data = os.urandom(size)
+    received = {}
+
+    def recv_task():
+        ymodem = Ymodem(PtyMasterStream(master))
+        filename, filesize = ymodem.initiate_recv()
+        received[filename] = ymodem.recv(filesize)
+
+    with SerialStream(os.ttyname(slave), baudrate=baudrate) as stream:
+        thread = threading.Thread(target=recv_task)
+        thread.start()
+        ymodem = Ymodem(stream)
+        success = ymodem.send("pty.bin", data, show_bar=True)
+        thread.join()
+
+    if not success or received.get("pty.bin") != data:
+        print("failed to send file")
+        return
+
+    print("File transfer completed. Total retransmissions: ", ymodem.retransmission_count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Send a file using Ymodem protocol over a pty pair.')
+    parser.add_argument('-s', '--size', type=int, help='Size of the random file to send.', default=100000)
+    parser.add_argument('-b', '--baudrate', type=int, help='Baud rate of the serial port.', default=921600)
+    args = parser.parse_args()
+    main(args.size, args.baudrate)
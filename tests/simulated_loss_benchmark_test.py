@@ -0,0 +1,119 @@
+from mcfs_tools.ymodem import Ymodem, AdaptiveBlockSizePolicy, Logger
+from mcfs_tools.clock import SimulatedClock
+from mcfs_tools.streams.loopback_stream import LoopbackStream
+from mcfs_tools.streams.fault_injection_stream import FaultInjectionStream, FaultInjector, BernoulliFaults, GilbertElliottFaults
+import argparse
+import logging
+import random
+import time
+
+
+def make_model(burst: bool, loss: float):
+    if burst:
+        return GilbertElliottFaults(loss / 10, 0.3, loss, 0.2)
+    return BernoulliFaults(loss)
+
+
+def run_scenario(seed: int, loss: float, size: int, burst: bool, adaptive: bool, limit: float, batch: bool = False) -> tuple:
+    """
+    One transfer over a lossy loopback pair in simulated time, faults on both directions.
+    With batch, a half size boot image and the application are sent in one batch session.
+    :return: (ok, simulated seconds, retransmissions, timeouts,
+        True if the sender reported success but the receiver got different data)
+    """
+    rng = random.Random(seed)
+    files = [("boot.bin", rng.randbytes(size // 2)), ("app.bin", rng.randbytes(size))] if batch else [("sim.bin", rng.randbytes(size))]
+    clock = SimulatedClock(limit=limit)
+    host, motor = LoopbackStream.pair(clock=clock)
+    host = FaultInjectionStream(host, rx=FaultInjector(make_model(burst, loss), drop=1, corrupt=1, seed=seed))
+    motor = FaultInjectionStream(motor, rx=FaultInjector(make_model(burst, loss), drop=1, corrupt=1, seed=seed + 1))
+
+    sender = Ymodem(host, block_policy=AdaptiveBlockSizePolicy() if adaptive else None)
+    receiver = Ymodem(motor)
+
+    def recv():
+        if batch:
+            return receiver.recv_batch()
+        filename, filesize = receiver.initiate_recv()
+        return [(filename, receiver.recv(filesize))]
+
+    def send():
+        if batch:
+            return sender.send_batch(files)
+        return sender.send(*files[0])
+
+    silent = False
+    try:
+        sent, received = clock.run(send, recv)
+        ok = sent and received == files
+        silent = sent and not ok
+    except TimeoutError:
+        ok = False
+    return ok, clock.time(), sender.stats.retransmissions, sender.stats.timeouts, silent
+
+
+def check_block_size_recovery() -> bool:
+    """
+    The adaptive policy must drop to 128 byte blocks on a noisy line and return to 1024 once the errors stop.
+    """
+    policy = AdaptiveBlockSizePolicy()
+    for i in range(16):
+        policy.record(i % 2 == 0, 1029)
+        if policy.block_size == 128:
+            break
+    else:
+        print("Adaptive policy did not switch to 128 byte blocks on a noisy line.")
+        return False
+
+    for _ in range(200):
+        policy.record(True, 133)
+        if policy.block_size == 1024:
+            return True
+    print("Adaptive policy did not return to 1024 byte blocks after the errors stopped.")
+    return False
+
+
+def main(losses: list, scenarios: int, size: int, burst: bool, adaptive: bool, limit: float, check: bool, batch: bool):
+
+    Logger.setLevel(logging.CRITICAL)
+    if check and not check_block_size_recovery():
+        exit(1)
+    start = time.perf_counter()
+    total = 0
+    for loss in losses:
+        results = [run_scenario(seed, loss, size, burst, adaptive, limit, batch) for seed in range(scenarios)]
+        total += len(results)
+        ok = [r for r in results if r[0]]
+        durations = sorted(r[1] for r in ok)
+        median = durations[len(durations) // 2] if durations else float("nan")
+        p99 = durations[int(len(durations) * 0.99)] if durations else float("nan")
+        print(f"loss {loss:8.1e}  ok {len(ok):5d}/{len(results):<5d}  "
+              f"time median {median:8.3f} s  p99 {p99:8.3f} s  "
+              f"retransmissions {sum(r[2] for r in results) / len(results):7.2f}  "
+              f"timeouts {sum(r[3] for r in results) / len(results):6.2f}  "
+              f"silent corruptions {sum(r[4] for r in results)}")
+
+        if check:
+            if any(r[4] for r in results):
+                print("The sender reported success for data the receiver did not get.")
+                exit(1)
+            again = [run_scenario(seed, loss, size, burst, adaptive, limit, batch) for seed in range(min(scenarios, 20))]
+            if again != results[:len(again)]:
+                print("Simulated runs are not deterministic.")
+                exit(1)
+
+    print(f"{total} transfers in {time.perf_counter() - start:.1f} s wall time.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark Ymodem retransmission and timeout handling over lossy loopback streams in simulated time.')
+    parser.add_argument('--losses', type=str, help='Comma separated per byte fault rates.', default="0,1e-5,1e-4,1e-3")
+    parser.add_argument('-n', '--scenarios', type=int, help='Number of seeds per fault rate.', default=250)
+    parser.add_argument('-s', '--size', type=int, help='Size of the random file to send.', default=4096)
+    parser.add_argument('--burst', action="store_true", help='Gilbert-Elliott burst faults instead of independent ones.')
+    parser.add_argument('-a', '--adaptive_block', action="store_true", help='Use the adaptive block size policy.')
+    parser.add_argument('--limit', type=float, help='Simulated seconds after which a transfer counts as failed.', default=600)
+    parser.add_argument('--batch', action="store_true", help='Send a boot and an application image in one batch session.')
+    parser.add_argument('--check', action="store_true", help='Check that the adaptive block size recovers, run the first seeds twice and fail if the results differ.')
+    args = parser.parse_args()
+    main([float(l) for l in args.losses.split(",")], args.scenarios, args.size, args.burst, args.adaptive_block, args.limit, args.check, args.batch)
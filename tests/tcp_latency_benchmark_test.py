@@ -0,0 +1,90 @@
+from mcfs_tools.ymodem import Ymodem, Logger
+from mcfs_tools.streams.tcp_stream import TCPClientStream, TCPServerStream
+import argparse
+import logging
+import os
+import threading
+import time
+
+
+def open_pair(low_latency: bool):
+    server = TCPServerStream(0, low_latency=low_latency)
+    port = server.socket.getsockname()[1]
+    thread = threading.Thread(target=server.connect)
+    thread.start()
+    client = TCPClientStream("localhost", port, low_latency=low_latency)
+    client.connect()
+    thread.join()
+    return server, client
+
+
+def measure_rtt(server, client, iterations: int) -> list:
+    """
+    Stop-and-wait round trips: a 1029 byte Ymodem packet one way, a 1 byte ACK back.
+    """
+    packet = bytes(1029)
+
+    def responder():
+        for _ in range(iterations):
+            for _ in range(len(packet)):
+                if client.wait_recv_byte(1.0) == -1:
+                    return
+            client.send(bytes([Ymodem.ACK]))
+
+    thread = threading.Thread(target=responder)
+    thread.start()
+    rtts = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        server.send(packet)
+        if server.wait_recv_byte(1.0) != Ymodem.ACK:
+            break
+        rtts.append(time.perf_counter() - start)
+    thread.join()
+    return rtts
+
+
+def measure_transfer(server, client, size: int) -> float:
+    data = os.urandom(size)
+    received = {}
+
+    def recv_task():
+        ymodem = Ymodem(client)
+        filename, filesize = ymodem.initiate_recv()
+        received["data"] = ymodem.recv(filesize)
+
+    thread = threading.Thread(target=recv_task)
+    thread.start()
+    start = time.perf_counter()
+    ok = Ymodem(server).send("latency.bin", data)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    if not ok or received.get("data") != data:
+        raise RuntimeError("transfer failed")
+    return elapsed
+
+
+def main(iterations: int, size: int):
+
+    Logger.setLevel(logging.WARNING)
+    for low_latency in (False, True):
+        server, client = open_pair(low_latency)
+        rtts = sorted(measure_rtt(server, client, iterations))
+        elapsed = measure_transfer(server, client, size)
+
+        start = time.perf_counter()
+        client.disconnect()
+        server.disconnect()
+        shutdown = time.perf_counter() - start
+
+        mode = "low latency" if low_latency else "threaded"
+        print(f"{mode:12s} rtt median {rtts[len(rtts) // 2] * 1e3:7.3f} ms  p99 {rtts[int(len(rtts) * 0.99)] * 1e3:7.3f} ms  "
+              f"transfer {size / elapsed / 1024:8.1f} KiB/s  disconnect {shutdown * 1e3:7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Localhost latency benchmark of the TCP streams.')
+    parser.add_argument('-n', '--iterations', type=int, help='Number of packet round trips.', default=500)
+    parser.add_argument('-s', '--size', type=int, help='Size of the file for the transfer benchmark.', default=200000)
+    args = parser.parse_args()
+    main(args.iterations, args.size)